@@ -0,0 +1,165 @@
+"""
+Local stand-in for the Scryfall API used by the benchmarks.
+
+Serves ``/sets``, ``/symbology`` and the icons they reference from the
+fixtures in the repository's ``svg/`` directory: lowercase file names are set
+icons, uppercase / numeric ones card symbols.
+
+    python benchmarks/fake_scryfall.py --port 8000
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURE_DIR = ROOT / "svg"
+
+# Card symbols are named like their mana symbol, e.g. W.svg, 2U.svg, 10.svg
+SYMBOL_PATTERN = re.compile(r"^[A-Z0-9]+$")
+
+# Rendered label pages that live next to the icons
+IGNORED_PATTERN = re.compile(r"^labels-")
+
+# Scryfall versions icon URLs with a timestamp query string
+ICON_VERSION = "1700000000"
+
+
+def build_routes(base_url, fixture_dir=FIXTURE_DIR):
+    """
+    Build the catalogs and icon routes served by the fake API.
+
+    Args:
+        base_url (str): The URL the server is reachable at.
+        fixture_dir (Path): Directory holding the SVG fixtures.
+
+    Returns:
+        dict: Path to (content type, body) of every route.
+    """
+    routes = {}
+    sets = []
+    symbols = []
+    release = date(1993, 8, 5)
+
+    for path in sorted(fixture_dir.glob("*.svg")):
+        name = path.stem
+        if IGNORED_PATTERN.match(name):
+            continue
+        body = path.read_bytes()
+        if SYMBOL_PATTERN.match(name):
+            route = f"/card-symbols/{name}.svg"
+            symbols.append(
+                {
+                    "object": "card_symbol",
+                    "symbol": f"{{{name}}}",
+                    "svg_uri": base_url + route,
+                }
+            )
+        else:
+            route = f"/sets/{name}.svg"
+            sets.append(
+                {
+                    "object": "set",
+                    "code": name,
+                    "name": f"Set {name.upper()}",
+                    "released_at": release.isoformat(),
+                    "set_type": "expansion",
+                    "card_count": 250,
+                    "digital": False,
+                    "icon_svg_uri": f"{base_url}{route}?{ICON_VERSION}",
+                }
+            )
+            release += timedelta(days=30)
+        routes[route] = ("image/svg+xml", body)
+
+    for route, data in (("/sets", sets), ("/symbology", symbols)):
+        body = json.dumps({"object": "list", "has_more": False, "data": data})
+        routes[route] = ("application/json", body.encode())
+    return routes
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep connections alive like the real API, so the session's pool is used
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        route = self.path.split("?", 1)[0]
+        if route not in self.server.routes:
+            self.send_error(404)
+            return
+
+        content_type, body = self.server.routes[route]
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        with self.server.lock:
+            self.server.requests += 1
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeScryfall:
+    """
+    Fake Scryfall API running in a background thread.
+
+        with FakeScryfall() as api:
+            requests.get(api.url + "/sets")
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, fixture_dir=FIXTURE_DIR):
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.server.routes = build_routes(self.url, fixture_dir)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Scryfall API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    with FakeScryfall(args.host, args.port) as api:
+        print(f"Serving fake Scryfall API at {api.url}")
+        try:
+            api.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Stage-level benchmarks of the label generator.
+
+Every stage of the pipeline is timed on its own against a local fake Scryfall
+API serving the fixtures in ``svg/`` (see fake_scryfall.py), so results do not
+depend on the network. Each stage gets fresh caches and output directories;
+its inputs are prepared outside of the timed section.
+
+    python benchmarks/run.py                      # Run every stage
+    python benchmarks/run.py render svg2pdf       # Run some stages
+    python benchmarks/run.py --record             # Append the results to history.jsonl
+    python benchmarks/run.py --compare            # Compare with the last recorded run
+"""
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import cached_property
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+ROOT = BENCHMARK_DIR.parent
+sys.path.insert(0, str(ROOT))
+
+import mtglabels.config as config
+from fake_scryfall import FakeScryfall
+
+HISTORY_PATH = BENCHMARK_DIR / "history.jsonl"
+
+TEMPLATE_NAME = "labels.svg"
+
+
+class Pipeline:
+    """
+    Inputs of the benchmarked stages, computed on first use from the output of
+    the previous stage.
+    """
+
+    def __init__(self, api, work_dir):
+        from mtglabels.layout import sheet_for
+        from mtglabels.scryfall import get_session
+
+        self.api = api
+        self.work_dir = Path(work_dir)
+        self.session = get_session()
+        self.sheet = sheet_for(30)
+        self.context = {"WIDTH": self.sheet.width, "HEIGHT": self.sheet.height}
+
+    def fresh_dir(self):
+        return Path(tempfile.mkdtemp(dir=self.work_dir))
+
+    @cached_property
+    def sets(self):
+        from mtglabels.catalog import CatalogCache
+
+        catalog = CatalogCache(cache_dir=self.fresh_dir())
+        return catalog.fetch(self.session, self.api.url + "/sets")["data"]
+
+    @cached_property
+    def icon_paths(self):
+        from mtglabels.icons import IconCache
+
+        icon_cache = IconCache(cache_dir=self.fresh_dir())
+        paths, _ = icon_cache.fetch(
+            self.session, [exp["icon_svg_uri"] for exp in self.sets]
+        )
+        return paths
+
+    @cached_property
+    def icon_library(self):
+        from mtglabels.icons import IconLibrary
+
+        icon_library = IconLibrary()
+        for exp in self.sets:
+            exp["icon_id"] = icon_library.add(self.icon_paths[exp["icon_svg_uri"]])
+        return icon_library
+
+    @cached_property
+    def labels(self):
+        self.icon_library
+        labels = [
+            {
+                "name": exp["name"],
+                "code": exp["code"],
+                "date": datetime.strptime(exp["released_at"], "%Y-%m-%d").date(),
+                "icons": [exp["icon_id"]],
+            }
+            for exp in self.sets
+            if exp["icon_id"]
+        ]
+        return self.sheet.place(labels)
+
+    @cached_property
+    def renderer(self):
+        from mtglabels.render import PageRenderer
+
+        return PageRenderer(
+            TEMPLATE_NAME, self.fresh_dir(), "labels", icon_library=self.icon_library
+        )
+
+    @cached_property
+    def batches(self):
+        per_sheet = self.sheet.labels_per_sheet
+        return [
+            self.labels[i : i + per_sheet]
+            for i in range(0, len(self.labels), per_sheet)
+        ]
+
+    @cached_property
+    def pages(self):
+        from mtglabels.render import get_template
+
+        template = get_template(TEMPLATE_NAME)
+        return [
+            template.render(**self.renderer.page_context(batch, self.context))
+            for batch in self.batches
+        ]
+
+    @cached_property
+    def pdfs(self):
+        import cairosvg
+
+        return [
+            cairosvg.svg2pdf(bytestring=page.encode(), unsafe=True)
+            for page in self.pages
+        ]
+
+
+# Stages set up their inputs and return the callable that is timed
+def catalog_stage(pipeline):
+    from mtglabels.catalog import CatalogCache
+
+    catalog = CatalogCache(cache_dir=pipeline.fresh_dir())
+
+    def run():
+        for endpoint in ("/sets", "/symbology"):
+            catalog.fetch(pipeline.session, pipeline.api.url + endpoint)
+
+    return run
+
+
+def icons_stage(pipeline):
+    from mtglabels.icons import IconCache
+
+    icon_cache = IconCache(cache_dir=pipeline.fresh_dir())
+    icon_urls = [exp["icon_svg_uri"] for exp in pipeline.sets]
+    return lambda: icon_cache.fetch(pipeline.session, icon_urls)
+
+
+def symbols_stage(pipeline):
+    from mtglabels.icons import IconLibrary
+
+    icon_paths = list(pipeline.icon_paths.values())
+
+    def run():
+        icon_library = IconLibrary()
+        for file_path in icon_paths:
+            icon_library.add(file_path)
+
+    return run
+
+
+def layout_stage(pipeline):
+    labels = [dict(label) for label in pipeline.labels]
+    return lambda: pipeline.sheet.place(labels)
+
+
+def render_stage(pipeline):
+    from mtglabels.render import render_svg
+
+    contexts = [
+        pipeline.renderer.page_context(batch, pipeline.context)
+        for batch in pipeline.batches
+    ]
+    outfile_svg = pipeline.fresh_dir() / "page.svg"
+
+    def run():
+        for context in contexts:
+            render_svg(TEMPLATE_NAME, context, outfile_svg, keep_svg=False)
+
+    return run
+
+
+def svg2pdf_stage(pipeline):
+    import cairosvg
+
+    pages = [page.encode() for page in pipeline.pages]
+
+    def run():
+        for page in pages:
+            cairosvg.svg2pdf(bytestring=page, unsafe=True)
+
+    return run
+
+
+def merge_stage(pipeline):
+    from mtglabels.render import combine_pdfs
+
+    output_dir = pipeline.fresh_dir()
+    pdfs = pipeline.pdfs
+    return lambda: combine_pdfs(output_dir, pdfs)
+
+
+def reset_templates():
+    """Forget the compiled templates, so the next load compiles from source."""
+    from mtglabels.render import ENV
+
+    ENV.bytecode_cache = None
+    ENV.cache.clear()
+
+
+def generate_labels_run(pipeline, cache_dir):
+    from mtglabels.generator import LabelGenerator
+
+    output_dir = pipeline.fresh_dir()
+
+    def run():
+        saved = config.API_ENDPOINT, config.CACHE_DIR
+        config.API_ENDPOINT, config.CACHE_DIR = pipeline.api.url, str(cache_dir)
+        try:
+            LabelGenerator(output_dir=output_dir).generate_labels()
+        finally:
+            config.API_ENDPOINT, config.CACHE_DIR = saved
+
+    return run
+
+
+def generate_labels_stage(pipeline):
+    # Cold run: nothing cached on disk or in the template environment
+    reset_templates()
+    return generate_labels_run(pipeline, pipeline.fresh_dir())
+
+
+def generate_labels_warm_stage(pipeline):
+    # Warm run: the catalog, icons and templates are cached by an untimed run
+    reset_templates()
+    cache_dir = pipeline.fresh_dir()
+    generate_labels_run(pipeline, cache_dir)()
+    return generate_labels_run(pipeline, cache_dir)
+
+
+STAGES = {
+    "catalog": catalog_stage,
+    "icons": icons_stage,
+    "symbols": symbols_stage,
+    "layout": layout_stage,
+    "render": render_stage,
+    "svg2pdf": svg2pdf_stage,
+    "merge": merge_stage,
+    "generate_labels": generate_labels_stage,
+    "generate_labels_warm": generate_labels_warm_stage,
+}
+
+
+def run_benchmarks(stages, repeat):
+    """
+    Time every stage ``repeat`` times.
+
+    Returns:
+        dict: Stage name to ``{"min": seconds, "median": seconds}``.
+    """
+    results = {}
+    with FakeScryfall() as api, tempfile.TemporaryDirectory() as work_dir:
+        pipeline = Pipeline(api, work_dir)
+        for name in stages:
+            timings = []
+            for _ in range(repeat):
+                run = STAGES[name](pipeline)
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            results[name] = {
+                "min": min(timings),
+                "median": statistics.median(timings),
+            }
+            print(
+                f"{name:>16}: {results[name]['min'] * 1000:9.2f} ms "
+                f"(median {results[name]['median'] * 1000:.2f} ms)"
+            )
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_recorded(history_path):
+    try:
+        lines = history_path.read_text().splitlines()
+    except OSError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results with a recorded run.
+
+    Returns:
+        list: Names of the stages that got slower than the tolerance allows.
+    """
+    print(f"\nCompared with {baseline['commit']} ({baseline['timestamp']}):")
+    regressions = []
+    for name, timing in results.items():
+        if name not in baseline["stages"]:
+            continue
+        ratio = timing["min"] / baseline["stages"][name]["min"]
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:>16}: {ratio:6.2f}x{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stages of the label generator"
+    )
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        help=f"Stages to run (default: all of {', '.join(STAGES)})",
+        metavar="STAGE",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Run every stage this many times and keep the fastest (default: 3)",
+    )
+    parser.add_argument(
+        "--history",
+        type=Path,
+        default=HISTORY_PATH,
+        help="History of recorded runs (default: benchmarks/history.jsonl)",
+    )
+    parser.add_argument(
+        "--record", action="store_true", help="Append the results to the history"
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Fail if a stage is slower than in the last recorded run",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown for --compare, as a fraction (default: 0.25)",
+    )
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON")
+    args = parser.parse_args()
+    unknown = [name for name in args.stages if name not in STAGES]
+    if unknown:
+        parser.error(
+            f"unknown stages: {', '.join(unknown)} (choose from {', '.join(STAGES)})"
+        )
+
+    logging.disable(logging.INFO)
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "stages": run_benchmarks(args.stages or list(STAGES), args.repeat),
+    }
+
+    regressions = []
+    baseline = last_recorded(args.history)
+    if args.compare:
+        if baseline:
+            regressions = compare(results["stages"], baseline, args.tolerance)
+        else:
+            print(f"\nNo recorded run in {args.history} to compare with")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if args.record:
+        with args.history.open("a") as fd:
+            fd.write(json.dumps(results) + "\n")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import mtglabels.config as config
+
+log = logging.getLogger(__name__)
+
+
+def file_digest(path):
+    """
+    Hash the contents of a file.
+
+    Returns:
+        str: The hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as fd:
+        for chunk in iter(lambda: fd.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_current(source, target):
+    """
+    Check whether a staged asset still matches its source.
+
+    A link to the source always matches. A copy matches when its size and
+    modification time are those of the source, or, failing that, when its
+    contents hash the same.
+
+    Returns:
+        bool: True if ``target`` can be used as is.
+    """
+    try:
+        target_stat = target.stat()
+    except FileNotFoundError:
+        return False
+    source_stat = source.stat()
+
+    if (source_stat.st_dev, source_stat.st_ino) == (
+        target_stat.st_dev,
+        target_stat.st_ino,
+    ):
+        return True
+    if source_stat.st_size != target_stat.st_size:
+        return False
+    if source_stat.st_mtime_ns == target_stat.st_mtime_ns:
+        return True
+    return file_digest(source) == file_digest(target)
+
+
+class AssetStager:
+    """
+    Places the raster assets referenced by the label templates in an asset
+    directory, once per distinct file and run.
+
+    Assets are hard-linked when possible, symlinked across file systems and
+    copied as a last resort. An asset already staged by an earlier run is
+    kept if it is unchanged, so the directory can be shared by several output
+    directories.
+    """
+
+    def __init__(self, asset_dir=None):
+        """
+        Initialize the AssetStager.
+
+        Args:
+            asset_dir (Path): Where assets are placed. Defaults to ``assets`` in config.CACHE_DIR.
+        """
+        self.asset_dir = Path(asset_dir or Path(config.CACHE_DIR) / "assets")
+        self.asset_dir.mkdir(parents=True, exist_ok=True)
+        # Source path -> staged path of the assets staged by this run
+        self.staged = {}
+
+    def stage(self, source):
+        """
+        Stage an asset, unless it already was during this run.
+
+        Args:
+            source (Path): The asset file.
+
+        Returns:
+            Path: The path of the staged asset.
+        """
+        source = Path(source).resolve()
+        if source in self.staged:
+            return self.staged[source]
+
+        target = self.asset_dir / source.name
+        if is_current(source, target):
+            log.debug(f"Asset {target} is up to date")
+        else:
+            self.place(source, target)
+        self.staged[source] = target
+        return target
+
+    def place(self, source, target):
+        """
+        Link or copy ``source`` to ``target``, replacing ``target`` atomically.
+        """
+        # Runs sharing the asset directory may stage the same asset at once,
+        # so the temporary link is unique to the process and thread
+        part_path = target.with_name(
+            f"{target.name}.{os.getpid()}.{threading.get_ident()}.part"
+        )
+        part_path.unlink(missing_ok=True)
+        try:
+            os.link(source, part_path)
+        except OSError:
+            try:
+                os.symlink(source, part_path)
+            except OSError:
+                # copy2 keeps the modification time, so the copy is seen as
+                # current by later runs without hashing it
+                shutil.copy2(source, part_path)
+        os.replace(part_path, target)
+        # Renaming a link onto another link of the same file, e.g. one
+        # another run just staged, leaves both in place
+        part_path.unlink(missing_ok=True)
+        log.debug(f"Staged {source} as {target}")
@@ -0,0 +1,305 @@
+"""
+Run many label jobs in one process.
+
+A job file is a TOML document: top-level options apply to the whole batch,
+and every ``[[job]]`` table is one run of a label generator writing to its
+own output directory::
+
+    jobs = 4                        # Render worker processes, shared by all jobs
+
+    [[job]]
+    output_dir = "output/customer-a"
+    sets = ["lea", "mh1", "neo"]
+    labels_per_sheet = 24
+
+    [[job]]
+    generator = "color"
+    output_dir = "output/color-cost"
+    type = "cost"
+
+The jobs share the fetched /sets and /symbology catalogs, the icon cache and
+parsed icons, the compiled templates and the render worker pool.
+"""
+
+import argparse
+import importlib.util
+import logging
+from pathlib import Path
+
+import mtglabels.config as config
+from mtglabels.layout import SHEETS, parse_sheet, sheet_for
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+log = logging.getLogger(__name__)
+
+# Options of the whole batch
+BATCH_OPTIONS = {"jobs", "offline", "catalog_ttl", "record", "replay", "job"}
+
+# Options of a job shared by both generators, with the LabelGenerator
+# argument they set
+JOB_OPTIONS = {
+    "output_dir": "output_dir",
+    "labels_per_sheet": "labels_per_sheet",
+    "sheet": "sheet",
+    "keep_svg": "keep_svg",
+    "keep_pages": "keep_pages",
+    "renderer": "renderer",
+    "incremental": "incremental",
+    "split_pages": "split_pages",
+    "format": "output_format",
+    "dpi": "dpi",
+    "profile": "profile",
+    "profile_stage": "profile_stage",
+}
+
+# Job options of the set generator selecting sets, with the SetFilter field
+# they set
+SET_FILTER_OPTIONS = {
+    "released_after": "released_after",
+    "released_before": "released_before",
+    "set_types": "set_types",
+    "min_cards": "min_cards",
+    "parent": "parent",
+    "digital": "digital",
+}
+
+# Job options of every generator, named like their command-line options
+GENERATOR_OPTIONS = {
+    "sets": {**JOB_OPTIONS, **SET_FILTER_OPTIONS},
+    "color": {
+        **JOB_OPTIONS,
+        "type": "label_types",
+        "repeat": "label_repeat",
+        "offset_y": "offset_y",
+        "outline": "outline",
+        "asset_dir": "asset_dir",
+    },
+}
+
+
+class JobFileError(ValueError):
+    """
+    Raised when a job file cannot be read or holds an invalid job.
+    """
+
+
+def load_generator(name):
+    """
+    Get the LabelGenerator class of a generator.
+
+    The color generator lives in ``generator-color.py``, which cannot be
+    imported by name, so it is loaded from its path.
+    """
+    if name == "sets":
+        from mtglabels.generator import LabelGenerator
+
+        return LabelGenerator
+
+    path = Path(__file__).resolve().parent / "generator-color.py"
+    spec = importlib.util.spec_from_file_location("mtglabels.generator_color", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.LabelGenerator
+
+
+def read_jobs(path):
+    """
+    Read and validate a job file.
+
+    Args:
+        path (Path): The TOML job file.
+
+    Returns:
+        tuple: (batch options dict, list of job dicts)
+
+    Raises:
+        JobFileError: If the file cannot be parsed or a job is invalid.
+    """
+    if tomllib is None:
+        raise JobFileError("Reading job files needs Python 3.11 or the tomli package")
+    try:
+        with Path(path).open("rb") as fd:
+            document = tomllib.load(fd)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise JobFileError(f"Cannot read {path}: {e}")
+
+    unknown = set(document) - BATCH_OPTIONS
+    if unknown:
+        raise JobFileError(f"Unknown batch options: {', '.join(sorted(unknown))}")
+
+    jobs = document.get("job", [])
+    if not jobs:
+        raise JobFileError(f"{path} defines no [[job]]")
+
+    for number, job in enumerate(jobs, start=1):
+        generator = job.get("generator", "sets")
+        if generator not in GENERATOR_OPTIONS:
+            raise JobFileError(
+                f"Job {number}: unknown generator {generator!r}; "
+                f"use one of {', '.join(GENERATOR_OPTIONS)}"
+            )
+        allowed = {"generator", "sets", *GENERATOR_OPTIONS[generator]}
+        unknown = set(job) - allowed
+        if unknown:
+            raise JobFileError(
+                f"Job {number}: unknown options {', '.join(sorted(unknown))}"
+            )
+        if "output_dir" not in job:
+            raise JobFileError(f"Job {number}: output_dir is required")
+        if "labels_per_sheet" in job:
+            try:
+                sheet_for(int(job["labels_per_sheet"]))
+            except (KeyError, TypeError, ValueError):
+                raise JobFileError(
+                    f"Job {number}: labels_per_sheet must be one of "
+                    + ", ".join(
+                        name.split("-")[1]
+                        for name in SHEETS
+                        if name.startswith("letter-")
+                    )
+                )
+        if "sheet" in job:
+            try:
+                parse_sheet(job["sheet"])
+            except ValueError as e:
+                raise JobFileError(f"Job {number}: {e}")
+        if job.get("renderer", config.DEFAULT_RENDERER) not in config.RENDERERS:
+            raise JobFileError(
+                f"Job {number}: renderer must be one of {', '.join(config.RENDERERS)}"
+            )
+        if job.get("format", config.DEFAULT_FORMAT) not in config.OUTPUT_FORMATS:
+            raise JobFileError(
+                f"Job {number}: format must be one of "
+                f"{', '.join(config.OUTPUT_FORMATS)}"
+            )
+
+    options = {key: value for key, value in document.items() if key != "job"}
+    return options, jobs
+
+
+def run_job(generator_class, job, resources, jobs):
+    """
+    Run a single job with the shared resources.
+
+    Set filters changed by a job with explicit set codes are restored
+    afterwards, so they do not leak into later jobs.
+    """
+    options = GENERATOR_OPTIONS[job.get("generator", "sets")]
+    kwargs = {
+        options[key]: value
+        for key, value in job.items()
+        if key not in ("generator", "sets", *SET_FILTER_OPTIONS)
+    }
+    if "sheet" in kwargs:
+        kwargs["sheet"] = parse_sheet(kwargs["sheet"])
+
+    predicates = {
+        SET_FILTER_OPTIONS[key]: value
+        for key, value in job.items()
+        if key in SET_FILTER_OPTIONS
+    }
+    if predicates:
+        from mtglabels.setdb import SetFilter
+
+        if "set_types" in predicates:
+            predicates["set_types"] = tuple(predicates["set_types"])
+        kwargs["set_filter"] = SetFilter(**predicates)
+
+    saved = config.IGNORED_SETS, config.MINIMUM_SET_SIZE, config.SET_TYPES
+    try:
+        generator = generator_class(jobs=jobs, resources=resources, **kwargs)
+        generator.generate_labels(job.get("sets"))
+    finally:
+        config.IGNORED_SETS, config.MINIMUM_SET_SIZE, config.SET_TYPES = saved
+
+
+def run_batch(options, jobs):
+    """
+    Run every job of a batch, sharing caches and the render worker pool.
+
+    A failing job is logged and does not stop the batch.
+
+    Returns:
+        int: The number of failed jobs.
+    """
+    import requests
+
+    from mtglabels.resources import Resources
+
+    workers = options.get("jobs", 1)
+    failed = 0
+    with Resources(
+        offline=options.get("offline", False),
+        catalog_ttl=options.get("catalog_ttl"),
+        record=options.get("record"),
+        replay=options.get("replay"),
+    ) as resources:
+        if workers > 1:
+            resources.start_pool(workers)
+
+        generators = {}
+        for number, job in enumerate(jobs, start=1):
+            name = job.get("generator", "sets")
+            log.info(f"Job {number}/{len(jobs)}: {name} labels in {job['output_dir']}")
+            if name not in generators:
+                generators[name] = load_generator(name)
+            try:
+                run_job(generators[name], job, resources, workers)
+            except requests.exceptions.RequestException as e:
+                log.error(
+                    "Job %d: error occurred while making a request: %s", number, e
+                )
+                failed += 1
+            except Exception as e:
+                log.exception("Job %d: an unexpected error occurred: %s", number, e)
+                failed += 1
+    return failed
+
+
+def parse_arguments(argv):
+    """
+    Parse command-line arguments.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mtglabels batch",
+        description="Run the label jobs of a TOML job file in one process",
+    )
+    parser.add_argument("job_file", type=Path, help="The TOML job file")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Render pages in this many worker processes, overriding the job file",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function for the ``mtglabels batch`` subcommand.
+    """
+
+    args = parse_arguments(argv)
+
+    try:
+        options, jobs = read_jobs(args.job_file)
+    except JobFileError as e:
+        log.error(str(e))
+        return 2
+    if args.jobs is not None:
+        options["jobs"] = args.jobs
+
+    failed = run_batch(options, jobs)
+    if failed:
+        log.error(f"{failed} of {len(jobs)} jobs failed")
+        return 1
+    return 0
@@ -0,0 +1,150 @@
+import argparse
+import logging
+
+import mtglabels.config as config
+
+log = logging.getLogger(__name__)
+
+
+def warm(args):
+    """
+    Prefetch set and symbol icons into the icon cache, sync the set database
+    and compile the label templates.
+    """
+    from mtglabels.catalog import CatalogCache
+    from mtglabels.icons import IconCache
+    from mtglabels.render import precompile_templates
+    from mtglabels.scryfall import get_session
+    from mtglabels.setdb import SetDatabase, SetFilter
+
+    session = get_session()
+    catalog = CatalogCache(ttl=args.catalog_ttl)
+    icon_cache = IconCache()
+
+    if args.sets:
+        config.IGNORED_SETS = ()
+        config.MINIMUM_SET_SIZE = 0
+        config.SET_TYPES = ()
+
+    icon_urls = []
+    if not args.symbols_only:
+        set_db = SetDatabase()
+        set_db.sync(catalog.refresh(session, config.API_ENDPOINT + "/sets"))
+        icon_urls += [
+            exp["icon_svg_uri"]
+            for exp in set_db.select(SetFilter(codes=tuple(args.sets)))
+        ]
+        set_db.close()
+    if not args.sets_only:
+        data = catalog.fetch(session, config.API_ENDPOINT + "/symbology").get(
+            "data", []
+        )
+        icon_urls += [item["svg_uri"] for item in data]
+
+    _, failed = icon_cache.fetch(session, dict.fromkeys(icon_urls))
+    log.info(f"Cached {len(icon_urls) - len(failed)} of {len(icon_urls)} icons")
+
+    templates = precompile_templates()
+    log.info(f"Compiled {len(templates)} templates")
+    return 1 if failed else 0
+
+
+def stats(args):
+    """
+    Print statistics of the icon cache.
+    """
+    from mtglabels.icons import IconCache
+
+    for name, value in IconCache().stats().items():
+        print(f"{name:>10}: {value}")
+    return 0
+
+
+def prune(args):
+    """
+    Evict least recently used icons from the icon cache.
+    """
+    from mtglabels.icons import IconCache
+
+    icon_cache = IconCache()
+    max_bytes = 0 if args.all else args.max_mb * 1024 * 1024
+    removed, freed = icon_cache.prune(max_bytes)
+    icon_cache.save()
+    print(f"Removed {removed} icons ({freed} bytes)")
+    return 0
+
+
+def parse_arguments(argv):
+    """
+    Parse command-line arguments.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mtglabels cache", description="Manage the MTG label icon cache"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    warm_parser = commands.add_parser(
+        "warm", help="Prefetch icons and compile templates before a print run"
+    )
+    warm_parser.set_defaults(func=warm)
+    warm_parser.add_argument(
+        "--catalog-ttl",
+        type=int,
+        default=config.CATALOG_TTL,
+        help=(
+            "Seconds a cached catalog is used before it is revalidated "
+            f"(default: {config.CATALOG_TTL})"
+        ),
+    )
+    only = warm_parser.add_mutually_exclusive_group()
+    only.add_argument(
+        "--sets-only", action="store_true", help="Only prefetch set icons"
+    )
+    only.add_argument(
+        "--symbols-only", action="store_true", help="Only prefetch symbol icons"
+    )
+    warm_parser.add_argument(
+        "sets",
+        nargs="*",
+        help="Only prefetch icons of the specified set codes (e.g., MH1, NEO).",
+        metavar="SET",
+    )
+
+    stats_parser = commands.add_parser("stats", help="Show icon cache statistics")
+    stats_parser.set_defaults(func=stats)
+
+    prune_parser = commands.add_parser("prune", help="Evict least recently used icons")
+    prune_parser.set_defaults(func=prune)
+    prune_parser.add_argument(
+        "--max-mb",
+        type=int,
+        default=config.ICON_CACHE_MAX_BYTES // (1024 * 1024),
+        help=(
+            "Prune the cache down to this size in MiB "
+            f"(default: {config.ICON_CACHE_MAX_BYTES // (1024 * 1024)})"
+        ),
+    )
+    prune_parser.add_argument(
+        "--all", action="store_true", help="Remove every cached icon"
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function for the ``mtglabels cache`` subcommand.
+    """
+
+    args = parse_arguments(argv)
+
+    import requests
+
+    try:
+        return args.func(args)
+    except requests.exceptions.RequestException as e:
+        log.error("Error occurred while making a request: %s", str(e))
+        return 1
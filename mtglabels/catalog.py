@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+import mtglabels.config as config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# A token of a symbol string, e.g. ``W`` in ``{W}{U}``
+SYMBOL_PATTERN = re.compile(r"\{([A-Z0-9]+)\}")
+
+
+class CatalogUnavailable(requests.exceptions.RequestException):
+    """
+    Raised when a catalog is requested offline but no cached copy exists.
+    """
+
+
+class CatalogCache:
+    """
+    On-disk cache for the Scryfall catalog endpoints (/sets, /symbology).
+
+    A cached catalog is served as-is while it is younger than the TTL. Once
+    it expires the catalog is revalidated with a conditional request using the
+    stored ETag / Last-Modified headers, so an unchanged catalog costs a 304
+    instead of the full JSON body.
+
+    Each catalog is refreshed at most once per instance; later calls return
+    the same decoded data, which callers must not modify.
+    """
+
+    def __init__(self, cache_dir=None, ttl=None, offline=False):
+        """
+        Initialize the CatalogCache.
+
+        Args:
+            cache_dir (str): Directory holding the cached catalogs. Defaults to CACHE_DIR/catalog.
+            ttl (int): Seconds a cached catalog is used without revalidation. Defaults to CATALOG_TTL.
+            offline (bool): Only serve cached catalogs, never touch the network.
+        """
+        self.cache_dir = Path(cache_dir or Path(config.CACHE_DIR) / "catalog")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = config.CATALOG_TTL if ttl is None else ttl
+        self.offline = offline
+        # Catalogs already refreshed / decoded by this instance, by URL
+        self.refreshed = set()
+        self.loaded = {}
+
+        # Counters for this run
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.downloaded_bytes = 0
+
+    def counters(self):
+        """
+        Get the counters of this run.
+
+        Returns:
+            dict: Catalogs served from the cache, revalidated or downloaded,
+            and the number of bytes downloaded.
+        """
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "downloaded_bytes": self.downloaded_bytes,
+        }
+
+    def paths(self, url):
+        """
+        Get the body and metadata paths for a catalog URL.
+
+        Returns:
+            tuple: (body_path, meta_path)
+        """
+        name = urlparse(url).path.strip("/").replace("/", "_") or "index"
+        return self.cache_dir / f"{name}.json", self.cache_dir / f"{name}.meta.json"
+
+    def load_meta(self, meta_path):
+        try:
+            with meta_path.open() as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return {}
+
+    def save_meta(self, meta_path, meta):
+        write_atomic(meta_path, json.dumps(meta).encode())
+
+    def fetch(self, session, url):
+        """
+        Fetch a catalog, using the cached copy whenever possible.
+
+        Args:
+            session (requests.Session): The session used to perform the request.
+            url (str): The catalog URL.
+
+        Returns:
+            dict: The decoded catalog JSON.
+        """
+        if url not in self.loaded:
+            self.loaded[url] = self.load_body(self.refresh(session, url))
+        return self.loaded[url]
+
+    def refresh(self, session, url):
+        """
+        Make sure the cached copy of a catalog is current, revalidating or
+        downloading it as needed, without decoding it.
+
+        Args:
+            session (requests.Session): The session used to perform the request.
+            url (str): The catalog URL.
+
+        Returns:
+            Path: The cached catalog body.
+        """
+        body_path, meta_path = self.paths(url)
+        if url in self.refreshed:
+            return body_path
+        self.refresh_body(session, url, body_path, meta_path)
+        self.refreshed.add(url)
+        return body_path
+
+    def forget(self):
+        """
+        Forget the catalogs refreshed by this instance, so the next fetch
+        checks them against the TTL again.
+        """
+        self.refreshed.clear()
+        self.loaded.clear()
+
+    def refresh_body(self, session, url, body_path, meta_path):
+        meta = self.load_meta(meta_path) if body_path.exists() else {}
+
+        if self.offline:
+            if not meta:
+                raise CatalogUnavailable(f"No cached copy of {url} for offline use")
+            log.info(f"Using cached {url} (offline)")
+            self.hits += 1
+            return
+
+        age = time.time() - meta.get("fetched_at", 0)
+        if meta and age < self.ttl:
+            log.info(f"Using cached {url} ({int(age)}s old)")
+            self.hits += 1
+            return
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        resp = session.get(url, headers=headers)
+
+        if resp.status_code == 304 and meta:
+            log.info(f"Cached {url} is still current")
+            self.revalidated += 1
+            meta["fetched_at"] = time.time()
+            with locked(body_path.with_suffix(".lock")):
+                self.save_meta(meta_path, meta)
+            return
+
+        resp.raise_for_status()
+
+        self.misses += 1
+        self.downloaded_bytes += len(resp.content)
+        # Processes sharing the cache may refresh the catalog at once; the
+        # lock keeps the body and metadata of one response together, and
+        # the metadata is only written once the body is in place
+        with locked(body_path.with_suffix(".lock")):
+            write_atomic(body_path, resp.content)
+            self.save_meta(
+                meta_path,
+                {
+                    "url": url,
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                    "fetched_at": time.time(),
+                },
+            )
+
+    def load_body(self, body_path):
+        with body_path.open("rb") as fd:
+            return json.load(fd)
+
+
+@lru_cache(maxsize=None)
+def parse_symbols(symbol):
+    """
+    Split a symbol string such as ``{W}{U}`` into its tokens.
+
+    Returns:
+        tuple: The tokens, e.g. ``("W", "U")``.
+    """
+    return tuple(SYMBOL_PATTERN.findall(symbol))
+
+
+class SymbolCatalog:
+    """
+    Index of the /symbology catalog from symbol token to icon URL.
+
+    Tokens are named like the icon files, e.g. ``W`` for ``W.svg``, so the
+    icons of a symbol string are a lookup per token.
+    """
+
+    def __init__(self, data):
+        """
+        Initialize the SymbolCatalog.
+
+        Args:
+            data (list): List of symbol data dictionaries from the /symbology catalog.
+        """
+        self.icon_urls = {
+            Path(urlparse(item["svg_uri"]).path).stem: item["svg_uri"] for item in data
+        }
+
+    def icon_urls_of(self, items):
+        """
+        Get the icon URLs of the symbols used by label items.
+
+        Args:
+            items (list): Label items, e.g. config.COST_SYMBOLS.
+
+        Returns:
+            list: The distinct icon URLs, in order of first use.
+        """
+        tokens = dict.fromkeys(
+            token
+            for item in items
+            if "symbol" in item
+            for token in parse_symbols(item["symbol"])
+        )
+        unknown = [token for token in tokens if token not in self.icon_urls]
+        if unknown:
+            log.warning("Unknown symbols: %s", ", ".join(unknown))
+        return [self.icon_urls[token] for token in tokens if token in self.icon_urls]
+
+
+def write_atomic(path, data):
+    """
+    Write ``data`` to ``path`` through a temporary file so readers never see
+    a partially written file.
+    """
+    part_path = unique_part_path(path)
+    try:
+        with part_path.open("wb") as fd:
+            fd.write(data)
+        part_path.replace(path)
+    except OSError:
+        part_path.unlink(missing_ok=True)
+        raise
+
+
+def unique_part_path(path):
+    """
+    Get a temporary path to write ``path`` through, unique to the process and
+    thread, so concurrent writers sharing a cache never clash.
+    """
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive lock on ``path`` across processes. Without fcntl, e.g.
+    on Windows, nothing is locked.
+    """
+    if fcntl is None:
+        yield
+        return
+    with path.open("a") as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
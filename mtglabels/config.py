@@ -1,5 +1,46 @@
 API_ENDPOINT = "https://api.scryfall.com"
 
+# Maximum number of icons downloaded concurrently
+DOWNLOAD_WORKERS = 16
+
+# Directory for the persistent catalog and icon caches
+CACHE_DIR = "/tmp/mtglabels"
+
+# Seconds a cached /sets or /symbology catalog is used before it is revalidated
+CATALOG_TTL = 3600
+
+# Size cap of the icon cache; least recently used icons are evicted beyond it
+ICON_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Optimize downloaded icons (see mtglabels/svgopt.py) before they are inlined
+# into label sheets, keeping this many decimals in path data
+OPTIMIZE_ICONS = True
+SVG_PRECISION = 3
+
+# Renderer backends: "merge" converts every page on its own and merges the page
+# PDFs with PyPDF2; "single-pass" draws all pages onto one multi-page PDF surface
+RENDERERS = ("merge", "single-pass")
+DEFAULT_RENDERER = "merge"
+
+# Output formats: "pdf" writes the combined PDF, "png" a PNG of every page,
+# e.g. for previews and thumbnails, and "both" writes both
+OUTPUT_FORMATS = ("pdf", "png", "both")
+DEFAULT_FORMAT = "pdf"
+
+# Resolution of the page PNGs
+PNG_DPI = 150
+
+# Size cap of the raster cache of page PNGs; least recently used pages are
+# evicted beyond it
+RASTER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Pages per multi-page PDF when the single-pass renderer runs with several
+# jobs; fonts are embedded once per run of pages instead of once per page
+DOCUMENT_CHUNK_PAGES = 10
+
+# Number of generated PDFs `mtglabels serve` keeps in memory
+SERVE_CACHE_ENTRIES = 64
+
 # Set types we are interested in
 SET_TYPES = (
     "core",
@@ -1,53 +1,21 @@
 import argparse
 import logging
-import re
-import shutil
-from datetime import datetime
 import sys
 from pathlib import Path
+from urllib.parse import urlparse
 
 # Add the parent directory to sys.path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
-import cairosvg
-import jinja2
-import PyPDF2
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
 import mtglabels.config as config
+from mtglabels.assets import AssetStager
+from mtglabels.layout import SHEETS, sheet_argument, sheet_for
+from mtglabels.profiling import STAGES
 
 # Set up logging
 logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
 log = logging.getLogger(__name__)
 
-# Get the base directory of the script
-BASE_DIR = Path(__file__).resolve().parent
-
-# Set up the Jinja2 environment for template loading
-ENV = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(BASE_DIR / "templates"),
-    autoescape=jinja2.select_autoescape(["html", "xml"]),
-)
-
-# Retry Strategy for requests
-retry_strategy = Retry(
-    total=3,  # Total number of retries to allow
-    status_forcelist=[
-        429,
-        500,
-        502,
-        503,
-        504,
-    ],  # Status codes to retry    allowed_methods=
-    allowed_methods=["HEAD", "GET", "OPTIONS"],  # HTTP methods to retry
-    backoff_factor=1,  # Backoff factor for retries
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session = requests.Session()
-session.mount("https://", adapter)  # Mount the retry strategy
-
 
 class LabelGenerator:
     """
@@ -57,6 +25,9 @@ class LabelGenerator:
     # Default output directory for generated labels
     DEFAULT_OUTPUT_DIR = Path.cwd() / "output"
 
+    # Raster icons of the card type labels
+    PNG_DIR = Path(__file__).resolve().parent / "templates" / "png"
+
     # Label templates
     LABEL_TEMPLATE_FILENAME = "symbols.svg"
     DEFAULT_IS_OUTLINED = False
@@ -65,188 +36,237 @@ class LabelGenerator:
     DEFAULT_LABEL_REPEAT = False
     DEFAULT_OFFSET_Y = 90
 
-    # Margins and starting positions on the label page
-    MARGIN = 40  # in 1/10 mm
-
     def __init__(self,
                  labels_per_sheet=None,
                  output_dir=None,
                  label_types=None,
                  label_repeat=None,
                  offset_y=None,
-                 outline=None):
+                 outline=None,
+                 offline=False,
+                 catalog_ttl=None,
+                 jobs=1,
+                 keep_svg=False,
+                 keep_pages=False,
+                 renderer=None,
+                 sheet=None,
+                 incremental=False,
+                 split_pages=None,
+                 output_format=None,
+                 dpi=None,
+                 profile=None,
+                 profile_stage=None,
+                 record=None,
+                 replay=None,
+                 asset_dir=None,
+                 resources=None):
         """
         Initialize the LabelGenerator.
 
         Args:
-            labels_per_sheet (int): The number of labels per sheet.
+            labels_per_sheet (int): The number of labels per US Letter sheet.
             output_dir (str): The output directory for the generated labels. Defaults to DEFAULT_OUTPUT_DIR.
+            offline (bool): Only use cached catalogs and icons.
+            catalog_ttl (int): Seconds a cached catalog is used before revalidation. Defaults to config.CATALOG_TTL.
+            jobs (int): Number of worker processes used to render pages.
+            keep_svg (bool): Write the rendered SVG of every page to the output directory.
+            keep_pages (bool): Write the PDF of every page to the output directory.
+            renderer (str): The renderer backend, one of config.RENDERERS.
+            sheet (SheetSpec): The sheet geometry. Overrides labels_per_sheet.
+            incremental (bool): Only re-render pages whose contents changed since the last run.
+            split_pages (int): Split the combined PDF into files of at most this many pages.
+            output_format (str): Write the combined PDF, a PNG of every page or both, one of config.OUTPUT_FORMATS.
+            dpi (int): The resolution of the page PNGs. Defaults to config.PNG_DPI.
+            profile (str): Write a JSON report of stage timings, page render times and counters to this path.
+            profile_stage (str): Run this stage under cProfile, dumping the statistics next to the report.
+            record (str): Save every Scryfall response to this directory.
+            replay (str): Serve Scryfall responses from a directory saved with ``record`` instead of the network.
+            asset_dir (str): Directory the raster icons are staged in, shareable across output directories.
+            resources (Resources): Caches and render pool shared with other generators, e.g. by a batch run. Overrides offline, catalog_ttl, record and replay.
         """
-        self.set_codes = []
-        self.symbols = []
-        self.labels_per_sheet = labels_per_sheet or self.DEFAULT_LABELS_PER_SHEET
+        self.symbol_icons = {}
+        self.sheet = sheet or sheet_for(
+            labels_per_sheet or self.DEFAULT_LABELS_PER_SHEET
+        )
+        self.labels_per_sheet = self.sheet.labels_per_sheet
         self.label_types = label_types or self.DEFAULT_LABEL_TYPES
         self.label_repeat = label_repeat or self.DEFAULT_LABEL_REPEAT
         self.offset_y = offset_y or self.DEFAULT_OFFSET_Y
         self.is_outlined = outline or self.DEFAULT_IS_OUTLINED
         self.output_dir = Path(output_dir or self.DEFAULT_OUTPUT_DIR)
 
-        # Starting positions on the label page
-        self.START_X = self.MARGIN
-        self.START_Y = self.MARGIN + self.offset_y
-
-        self.tmp_png_dir = None
-        self.tmp_svg_dir = None
         self.setup_directories()
-
-        self.delta_y = None
-        self.delta_x = None
-        self.calculate_label_dimensions()
+        self.assets = AssetStager(asset_dir)
+
+        self.offline = offline
+        # The catalog, icon and render stages pull in requests, cairosvg and
+        # PyPDF2; they are imported only once the arguments are validated, so
+        # --help and argument errors return without loading them
+        from mtglabels.profiling import Profiler
+        from mtglabels.resources import Resources
+
+        self.resources = resources or Resources(
+            offline=offline, catalog_ttl=catalog_ttl, record=record, replay=replay
+        )
+        self.session = self.resources.session
+        self.catalog = self.resources.catalog
+        self.icon_cache = self.resources.icon_cache
+        self.icon_library = self.resources.icon_library
+        self.jobs = jobs
+        self.keep_svg = keep_svg
+        self.keep_pages = keep_pages
+        self.renderer = renderer or config.DEFAULT_RENDERER
+        self.incremental = incremental
+        self.split_pages = split_pages
+        self.output_format = output_format or config.DEFAULT_FORMAT
+        self.dpi = dpi or config.PNG_DPI
+        self.raster_cache = None
+        self.profile = profile
+        self.profiler = Profiler(profile_stage)
 
     def setup_directories(self):
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.tmp_png_dir = Path("/tmp/mtglabels/png")
-        self.tmp_png_dir.mkdir(parents=True, exist_ok=True)
-        self.tmp_svg_dir = Path("/tmp/mtglabels/svg")
-        self.tmp_svg_dir.mkdir(parents=True, exist_ok=True)
-
-    def calculate_label_dimensions(self):
-        self.delta_x = (config.LETTER_WIDTH - (2 * self.MARGIN)) / 3 + 10
-        self.delta_y = (config.LETTER_HEIGHT - (2 * self.MARGIN)) / (
-            self.labels_per_sheet / 3
-        ) - 18
-        # self.delta_y = (config.LETTER_HEIGHT - (2 * self.MARGIN)) / (
-        #     self.labels_per_sheet / 3
-        # ) - 18
 
     def generate_labels(self, sets=None):
         """
         Generate the MTG labels.
 
         Args:
-            sets (list): List of set codes to include. If None, all sets will be included.
+            sets (list): Unused; color labels do not depend on the selected sets.
         """
-        # Clean up any existing PDF files in the output directory
-        clean_up_pdfs(self.output_dir)
-
-        if sets:
-            config.IGNORED_SETS = ()
-            config.MINIMUM_SET_SIZE = 0
-            config.SET_TYPES = ()
-            self.set_codes = [exp.lower() for exp in sets]
-
-        page = 1
-
-        symbol_data = self.get_symbol_data()
-        self.download_symbol_icons(symbol_data)
-
-        labels = []
-        if self.label_types == 'all':
-            labels = self.create_symbol_label_data(config.ALL_SYMBOLS, repeat=self.label_repeat)
-        elif self.label_types == 'tca':
-            labels = self.create_symbol_label_data(config.TYPE_COST_ALPHA_SYMBOLS, repeat=self.label_repeat)
-        elif self.label_types == 'type':
-            labels = self.create_symbol_label_data(config.TYPE_SYMBOLS, repeat=self.label_repeat)
-        elif self.label_types == 'cost':
-            labels = self.create_symbol_label_data(config.COST_SYMBOLS, repeat=self.label_repeat)
-        elif self.label_types == 'alpha':
-            labels = self.create_symbol_label_data(config.ALPHABETICAL_SYMBOLS, repeat=self.label_repeat)
+        from mtglabels.render import (
+            PageRenderer,
+            RasterCache,
+            clean_up_pdfs,
+            combine_pdfs,
+            sheet_outline,
+        )
+
+        # Clean up any existing PDF files in the output directory, unless they
+        # are reused by an incremental run
+        if not self.incremental:
+            clean_up_pdfs(self.output_dir)
+            clean_up_pdfs(self.output_dir, "combined_labels*.pdf")
+        # Page PNGs are always written again, from the raster cache when the
+        # page did not change
+        clean_up_pdfs(self.output_dir, "labels-*.png")
+
+        from mtglabels.catalog import SymbolCatalog
+
+        with self.profiler.stage("catalog"):
+            symbol_catalog = SymbolCatalog(self.get_symbol_data())
+        with self.profiler.stage("icons"):
+            # Only the icons of the selected label types are needed
+            self.download_symbol_icons(
+                symbol_catalog.icon_urls_of(self.label_symbols())
+            )
+
+        with self.profiler.stage("layout"):
+            labels = self.create_labels()
 
         label_batches = [
             labels[i : i + self.labels_per_sheet]
             for i in range(0, len(labels), self.labels_per_sheet)
         ]
 
-        template_name = self.LABEL_TEMPLATE_FILENAME  # Use the defined constant
-
-        template = ENV.get_template(template_name)
-        for batch in label_batches:
-            output = template.render(
-                labels=batch, WIDTH=config.LETTER_WIDTH, HEIGHT=config.LETTER_HEIGHT, IS_OUTLINED=self.is_outlined
-            )
-            outfile_svg = (
-                self.output_dir / f"labels-{self.labels_per_sheet}-{page:02}.svg"
-            )
-            outfile_pdf = (
-                self.output_dir / f"labels-{self.labels_per_sheet}-{page:02}.pdf"
-            )
-
-            log.info(f"Writing {outfile_svg}...")
-            with outfile_svg.open("w") as fd:
-                fd.write(output)
-
-            log.info(f"Writing {outfile_pdf}...")
-            cairosvg.svg2pdf(
-                url=str(outfile_svg), write_to=str(outfile_pdf), unsafe=True
+        context = {
+            "WIDTH": self.sheet.width,
+            "HEIGHT": self.sheet.height,
+            "outline": (
+                sheet_outline(self.sheet, self.offset_y)
+                if self.is_outlined
+                else ""
+            ),
+        }
+        if self.output_format != "pdf":
+            self.raster_cache = RasterCache()
+        renderer = PageRenderer(
+            self.LABEL_TEMPLATE_FILENAME,
+            self.output_dir,
+            f"labels-{self.labels_per_sheet}",
+            jobs=self.jobs,
+            keep_svg=self.keep_svg,
+            keep_pages=self.keep_pages,
+            icon_library=self.icon_library,
+            profiler=self.profiler,
+            executor=self.resources.executor,
+            raster_cache=self.raster_cache,
+            dpi=self.dpi,
+        )
+        if self.output_format == "png":
+            with self.profiler.stage("render"):
+                renderer.render_png(label_batches, context)
+        elif self.incremental:
+            if self.renderer == "single-pass":
+                log.warning("Incremental runs use the merge renderer")
+            with self.profiler.stage("render"):
+                renderer.render_incremental(
+                    label_batches,
+                    context,
+                    self.output_dir / "combined_labels.pdf",
+                    self.split_pages,
+                )
+        elif self.renderer == "single-pass":
+            with self.profiler.stage("render"):
+                renderer.render_document(
+                    label_batches,
+                    context,
+                    self.output_dir / "combined_labels.pdf",
+                    self.split_pages,
+                )
+        else:
+            # Every page is merged as soon as it is rendered, instead of
+            # holding all page PDFs until the last one is done
+            pages = self.profiler.iterate(
+                "render", renderer.iter_render(label_batches, context)
             )
+            with self.profiler.stage("combine"):
+                combine_pdfs(self.output_dir, pages, self.split_pages)
 
-            page += 1
+        if self.profile:
+            self.write_profile()
 
-        combine_pdfs(self.output_dir)
-
-    def get_set_data(self):
+    def write_profile(self):
         """
-        Fetch set data from Scryfall API.
-
-        Example:
-          "data": [
+        Write the profiling report of the run, including the cache counters
+        and the size of the combined PDFs.
+        """
+        self.profiler.record("catalog", self.catalog.counters())
+        self.profiler.record("icons", self.icon_cache.counters())
+        if self.raster_cache is not None:
+            self.profiler.record("raster", self.raster_cache.counters())
+        self.profiler.record(
+            "output_bytes",
             {
-              "object": "set",
-              "id": "a7ecb771-d1b6-4dec-8cf5-8d45179f21e0",
-              "code": "fdn",
-              "mtgo_code": "fdn",
-              "arena_code": "fdn",
-              "name": "Foundations",
-              "uri": "https://api.scryfall.com/sets/a7ecb771-d1b6-4dec-8cf5-8d45179f21e0",
-              "scryfall_uri": "https://scryfall.com/sets/fdn",
-              "search_uri": "https://api.scryfall.com/cards/search?include_extras=true&include_variations=true&order=set&q=e%3Afdn&unique=prints",
-              "released_at": "2024-11-15",
-              "set_type": "core",
-              "card_count": 10,
-              "digital": false,
-              "nonfoil_only": false,
-              "foil_only": false,
-              "icon_svg_uri": "https://svgs.scryfall.io/sets/default.svg?1719806400"
+                path.name: path.stat().st_size
+                for path in sorted(self.output_dir.glob("combined_labels*.pdf"))
             },
-          ]
+        )
+        self.profiler.write(self.profile)
 
-        Returns:
-            list: List of set data dictionaries.
+    def label_symbols(self):
         """
+        Get the label items of the selected label types.
 
-        try:
-            log.info("Getting set data and icons from Scryfall")
-
-            resp = session.get("https://api.scryfall.com/sets")
-            resp.raise_for_status()
-
-            data = resp.json().get("data", [])
-
-            known_sets = {exp["code"] for exp in data}
-            specified_sets = (
-                {code.lower() for code in self.set_codes} if self.set_codes else set()
-            )
-            unknown_sets = specified_sets - known_sets
-
-            if unknown_sets:
-                log.warning("Unknown sets: %s", ", ".join(unknown_sets))
-
-            set_data = [
-                exp
-                for exp in data
-                if (
-                    exp["code"] not in config.IGNORED_SETS
-                    and exp["card_count"] >= config.MINIMUM_SET_SIZE
-                    and (not config.SET_TYPES or exp["set_type"] in config.SET_TYPES)
-                    and (not self.set_codes or exp["code"].lower() in specified_sets)
-                )
-            ]
-
-            return set_data
+        Returns:
+            list: Label items from config, e.g. config.COST_SYMBOLS.
+        """
+        return {
+            'all': config.ALL_SYMBOLS,
+            'tca': config.TYPE_COST_ALPHA_SYMBOLS,
+            'type': config.TYPE_SYMBOLS,
+            'cost': config.COST_SYMBOLS,
+            'alpha': config.ALPHABETICAL_SYMBOLS,
+        }.get(self.label_types, [])
+
+    def create_labels(self):
+        """
+        Create the label data of the selected label types.
 
-        except requests.exceptions.RequestException as e:
-            log.error("Error occurred while fetching set data: %s", str(e))
-            return []
+        Returns:
+            list: List of label data dictionaries.
+        """
+        return self.create_symbol_label_data(self.label_symbols(), repeat=self.label_repeat)
 
     def get_symbol_data(self):
         """
@@ -282,135 +302,67 @@ class LabelGenerator:
             list: List of symbol data dictionaries.
         """
 
+        import requests
+
         try:
             log.info("Getting symbol data and icons from Scryfall")
 
-            resp = session.get(config.API_ENDPOINT + "/symbology")
-            resp.raise_for_status()
-
-            data = resp.json().get("data", [])
-
-            known_symbols = {exp["symbol"] for exp in data}
-            specified_symbols = (
-                {symbol.lower() for symbol in self.symbols} if self.symbols else set()
+            catalog = self.catalog.fetch(
+                self.session, config.API_ENDPOINT + "/symbology"
             )
-            unknown_symbols = specified_symbols - known_symbols
-
-            if unknown_symbols:
-                log.warning("Unknown symbols: %s", ", ".join(unknown_symbols))
-
-            # set_data = [
-            #     exp
-            #     for exp in data
-            #     if (
-            #         exp["code"] not in config.IGNORED_SETS
-            #         and exp["card_count"] >= config.MINIMUM_SET_SIZE
-            #         and (not config.SET_TYPES or exp["set_type"] in config.SET_TYPES)
-            #         and (not self.set_codes or exp["code"].lower() in specified_symbols)
-            #     )
-            # ]
-
-            symbol_data = [
-                exp
-                for exp in data
-                # if (
-                #     exp["code"] not in config.IGNORED_SETS
-                #     and exp["card_count"] >= config.MINIMUM_SET_SIZE
-                #     and (not config.SET_TYPES or exp["set_type"] in config.SET_TYPES)
-                #     and (not self.set_codes or exp["code"].lower() in specified_symbols)
-                # )
-            ]
+            data = catalog.get("data", [])
 
-            return symbol_data
+            return data
 
         except requests.exceptions.RequestException as e:
             log.error("Error occurred while fetching symbol data: %s", str(e))
             return []
 
-    def create_set_label_data(self):
+    def download_symbol_icons(self, icon_urls):
         """
-        Create label data for the sets.
+        Download the symbol icons.
 
-        Returns:
-            list: List of label data dictionaries.
+        Args:
+            icon_urls (list): URLs of the symbol icons.
         """
-        labels = []
-        x = self.START_X
-        y = self.START_Y
-
-        set_data = self.get_set_data()
-
-        for exp in reversed(set_data):
-            name = config.RENAME_SETS.get(exp["name"], exp["name"])
-            icon_url = exp["icon_svg_uri"]
-            filename = Path(icon_url).name.split("?")[0]
-            file_path = self.tmp_svg_dir / filename
-
-            if file_path.exists():
-                log.debug(f"Skipping download. File already exists: {icon_url}")
-                icon_filename = filename
-            else:
-                try:
-                    response = session.get(icon_url)
-                    response.raise_for_status()
-                    with file_path.open("wb") as file:
-                        file.write(response.content)
-                    icon_filename = filename
-                except requests.exceptions.RequestException as e:
-                    log.error(f"Failed to download file: {icon_url}")
-                    log.error("Error occurred while downloading file: %s", str(e))
-                    icon_filename = None
-
-            if icon_filename:
-                shutil.copy(file_path, self.output_dir)
-                labels.append(
-                    {
-                        "name": name,
-                        "code": exp["code"],
-                        "date": datetime.strptime(
-                            exp["released_at"], "%Y-%m-%d"
-                        ).date(),
-                        "icon_filename": icon_filename,
-                        "x": x,
-                        "y": y,
-                    }
-                )
+        icon_paths, failed = self.icon_cache.fetch(self.session, icon_urls)
+        self.symbol_icons = {
+            Path(urlparse(icon_url).path).stem: file_path
+            for icon_url, file_path in icon_paths.items()
+            if icon_url not in failed
+        }
+
+    def symbol_label(self, item):
+        """
+        Create the label data of a label item.
 
-            y += self.delta_y
+        This is a lookup in the parsed symbols and staged icons; the config
+        item is left unchanged.
 
-            # Start a new column if needed
-            if len(labels) % (self.labels_per_sheet / 3) == 0:
-                x += self.delta_x
-                y = self.START_Y
+        Args:
+            item: Label item from config, with a ``symbol`` string or a PNG ``icon``.
 
-            # Start a new page if needed
-            if len(labels) % self.labels_per_sheet == 0:
-                x = self.START_X
-                y = self.START_Y
+        Returns:
+            dict: The label data, without coordinates.
+        """
+        from mtglabels.catalog import parse_symbols
 
-        return labels
+        label = {
+            "title": item["title"],
+        }
 
-    def download_symbol_icons(self, symbol_data):
-        """
-        Download the symbol icons.
-        """
+        if 'symbol' in item:
+            label["icons"] = [
+                self.icon_library.add(self.symbol_icons[token])
+                for token in parse_symbols(item['symbol'])
+                if token in self.symbol_icons
+            ]
+            label["symbol"] = item["symbol"]
+        elif 'icon' in item:
+            icon_path = self.assets.stage(self.PNG_DIR / item['icon'])
+            label["icon_paths"] = [str(icon_path)]
 
-        for item in symbol_data:
-            icon_url = item["svg_uri"]
-            filename = Path(icon_url).name.split("?")[0]
-            file_path = self.tmp_svg_dir / filename
-
-            if file_path.exists():
-                log.debug(f"Skipping download. File already exists: {icon_url}")
-            else:
-                try:
-                    response = session.get(icon_url)
-                    response.raise_for_status()
-                    with file_path.open("wb") as file:
-                        file.write(response.content)
-                except requests.exceptions.RequestException as e:
-                    log.error(f"Failed to download file: {icon_url}")
-                    log.error("Error occurred while downloading file: %s", str(e))
+        return label
 
     def create_symbol_label_data(self, symbols_list, repeat=False):
         """
@@ -423,89 +375,16 @@ class LabelGenerator:
         Returns:
             symbols_list: List of symbol data dictionaries with X/Y coordinates.
         """
-        labels = []
-        x = self.START_X
-        y = self.START_Y
-
-        pattern = re.compile(r'\{([A-Z0-9]+)\}')
-
-        def add_labels():
-            nonlocal x, y
-            for item in symbols_list:
-                label = {
-                    "title": item["title"],
-                    "x": x,
-                    "y": y,
-                }
-
-                if 'symbol' in item:
-                    symbols = pattern.findall(item['symbol'])
-                    item['symbols_list'] = symbols
-                    item['icon_paths'] = [str(self.tmp_svg_dir / f"{symbol}.svg") for symbol in symbols]
-                    for icon_path in item["icon_paths"]:
-                        shutil.copy(icon_path, self.output_dir)
-
-                    label["symbol"] = item["symbol"]
-                elif 'icon' in item:
-                    local_icon_path = Path(f"mtglabels/templates/png/{item['icon']}")
-                    tmp_icon_path = self.tmp_png_dir / item['icon']
-                    shutil.copy(local_icon_path, tmp_icon_path)
-                    item['icon_paths'] = [str(tmp_icon_path)]
-
-                if "icon_paths" in item:
-                    label["icon_paths"] = item["icon_paths"]
-
-                labels.append(label)
-
-                y += self.delta_y
-
-                # Start a new column if needed
-                if len(labels) % (self.labels_per_sheet / 3) == 0:
-                    x += self.delta_x
-                    y = self.START_Y
-
-                # Start a new page if needed
-                if len(labels) % self.labels_per_sheet == 0:
-                    x = self.START_X
-                    y = self.START_Y
-
-        # Add the initial labels
-        add_labels()
+        # Every item is turned into a label once; repeated passes copy it
+        labels = [self.symbol_label(item) for item in symbols_list]
 
         # If repeat is True, add repeated labels to fill the page
-        if repeat:
-            while len(labels) < self.labels_per_sheet:
-                add_labels()
-
-        return labels
-
-
-def clean_up_pdfs(output_dir, pattern="labels-*.pdf"):
-    # List all PDF files in the output directory that match the specified pattern
-    pdf_files = sorted(output_dir.glob(pattern))
-
-    for pdf_file in pdf_files:
-        try:
-            pdf_file.unlink()
-            log.info(f"Deleted {pdf_file}")
-        except Exception as e:
-            log.error(f"Error deleting {pdf_file}: {e}")
+        passes = 1
+        if repeat and labels:
+            passes = max(1, -(-self.labels_per_sheet // len(labels)))
+        labels = [dict(label) for _ in range(passes) for label in labels]
 
-
-def combine_pdfs(output_dir, pattern="labels-*.pdf"):
-    pdf_merger = PyPDF2.PdfMerger()
-
-    # List all PDF files in the output directory that match the specified pattern
-    pdf_files = sorted(output_dir.glob(pattern))
-
-    for pdf_file in pdf_files:
-        pdf_merger.append(str(pdf_file))
-
-    # Output combined PDF
-    combined_pdf_path = output_dir / "combined_labels.pdf"
-    with combined_pdf_path.open("wb") as combined_pdf:
-        pdf_merger.write(combined_pdf)
-        log.info(f"Writing {combined_pdf_path}...")
+        return self.sheet.place(labels, self.offset_y)
 
 
 def parse_arguments():
@@ -553,6 +432,126 @@ def parse_arguments():
         default=LabelGenerator.DEFAULT_IS_OUTLINED,
         help="Prints a rounded outline to simulate label dimensions; ideal for testing (default: False)"
     )
+    parser.add_argument(
+        "--sheet",
+        type=sheet_argument,
+        help=(
+            "Sheet geometry, overrides --labels-per-sheet: one of "
+            f"{', '.join(SHEETS)}, or custom key=value pairs such as "
+            "rows=8,cols=3,width=2100,height=2970,margin=40 (in 1/10 mm)"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Render pages in this many worker processes (default: 1)",
+    )
+    parser.add_argument(
+        "--renderer",
+        default=config.DEFAULT_RENDERER,
+        choices=config.RENDERERS,
+        help=(
+            "merge: convert pages separately (supports --jobs) and merge them; "
+            "single-pass: draw all pages into one PDF "
+            f"(default: {config.DEFAULT_RENDERER})"
+        ),
+    )
+    parser.add_argument(
+        "--keep-svg",
+        action="store_true",
+        help="Also write the SVG of every page to the output directory",
+    )
+    parser.add_argument(
+        "--keep-pages",
+        action="store_true",
+        help="Also write the PDF of every page to the output directory",
+    )
+    parser.add_argument(
+        "--split-pages",
+        type=int,
+        metavar="N",
+        help=(
+            "Split the combined PDF into combined_labels-001.pdf, "
+            "combined_labels-002.pdf, ... of at most N pages each; this also "
+            "bounds memory, as an unsplit PDF holds every page until it is written"
+        ),
+    )
+    parser.add_argument(
+        "--format",
+        dest="output_format",
+        default=config.DEFAULT_FORMAT,
+        choices=config.OUTPUT_FORMATS,
+        help=(
+            "pdf: write the combined PDF; png: write a labels-NN.png of every "
+            f"page; both: write both (default: {config.DEFAULT_FORMAT})"
+        ),
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=config.PNG_DPI,
+        help=(
+            "Resolution of the page PNGs, e.g. 30 for thumbnails "
+            f"(default: {config.PNG_DPI})"
+        ),
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            "Keep page PDFs and a manifest of their content hashes in the output "
+            "directory, and only re-render pages that changed"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="REPORT",
+        help=(
+            "Write a JSON report with per-stage wall time, per-page render times, "
+            "bytes downloaded, cache hits and peak memory to this file"
+        ),
+    )
+    parser.add_argument(
+        "--profile-stage",
+        choices=STAGES,
+        help="Also run this stage under cProfile, writing REPORT.pstats",
+    )
+    http = parser.add_mutually_exclusive_group()
+    http.add_argument(
+        "--record",
+        metavar="DIR",
+        help="Save every Scryfall response (catalogs and icons) to DIR",
+    )
+    http.add_argument(
+        "--replay",
+        metavar="DIR",
+        help=(
+            "Serve Scryfall responses recorded with --record from DIR "
+            "instead of the network"
+        ),
+    )
+    parser.add_argument(
+        "--asset-dir",
+        help=(
+            "Stage the card type icons in this directory, which can be shared "
+            f"by several output directories (default: {config.CACHE_DIR}/assets)"
+        ),
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached catalogs and icons; never touch the network",
+    )
+    parser.add_argument(
+        "--catalog-ttl",
+        type=int,
+        default=config.CATALOG_TTL,
+        help=(
+            "Seconds a cached catalog is used before it is revalidated "
+            f"(default: {config.CATALOG_TTL})"
+        ),
+    )
     parser.add_argument(
         "sets",
         nargs="*",
@@ -571,14 +570,33 @@ def main():
     Main function for running the label generation.
     """
 
+    args = parse_arguments()
+
+    import requests
+
     try:
-        args = parse_arguments()
         generator = LabelGenerator(args.labels_per_sheet,
                                    args.output_dir,
                                    args.type,
                                    args.repeat,
                                    args.offset_y,
-                                   args.outline)
+                                   args.outline,
+                                   offline=args.offline,
+                                   catalog_ttl=args.catalog_ttl,
+                                   jobs=args.jobs,
+                                   keep_svg=args.keep_svg,
+                                   keep_pages=args.keep_pages,
+                                   renderer=args.renderer,
+                                   sheet=args.sheet,
+                                   incremental=args.incremental,
+                                   split_pages=args.split_pages,
+                                   output_format=args.output_format,
+                                   dpi=args.dpi,
+                                   profile=args.profile,
+                                   profile_stage=args.profile_stage,
+                                   record=args.record,
+                                   replay=args.replay,
+                                   asset_dir=args.asset_dir)
         generator.generate_labels(args.sets)
     except requests.exceptions.RequestException as e:
         log.error("Error occurred while making a request: %s", str(e))
@@ -1,52 +1,22 @@
 import argparse
+import importlib
 import logging
-import shutil
-from datetime import datetime
+from dataclasses import replace
+from datetime import date, datetime
 import sys
 from pathlib import Path
 
 # Add the parent directory to sys.path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
-import cairosvg
-import jinja2
-import PyPDF2
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
 import mtglabels.config as config
+from mtglabels.layout import SHEETS, sheet_argument, sheet_for
+from mtglabels.profiling import STAGES
 
 # Set up logging
 logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
 log = logging.getLogger(__name__)
 
-# Get the base directory of the script
-BASE_DIR = Path(__file__).resolve().parent
-
-# Set up the Jinja2 environment for template loading
-ENV = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(BASE_DIR / "templates"),
-    autoescape=jinja2.select_autoescape(["html", "xml"]),
-)
-
-# Retry Strategy for requests
-retry_strategy = Retry(
-    total=3,  # Total number of retries to allow
-    status_forcelist=[
-        429,
-        500,
-        502,
-        503,
-        504,
-    ],  # Status codes to retry    allowed_methods=
-    allowed_methods=["HEAD", "GET", "OPTIONS"],  # HTTP methods to retry
-    backoff_factor=1,  # Backoff factor for retries
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session = requests.Session()
-session.mount("https://", adapter)  # Mount the retry strategy
-
 
 class LabelGenerator:
     """
@@ -56,44 +26,99 @@ class LabelGenerator:
     # Default output directory for generated labels
     DEFAULT_OUTPUT_DIR = Path.cwd() / "output"
 
-    # Margins and starting positions on the label page
-    MARGIN = 40  # in 1/10 mm
-    START_X = MARGIN
-    START_Y = MARGIN + 40
+    # Vertical offset of the first row of labels below the sheet margin
+    OFFSET_Y = 40  # in 1/10 mm
 
     # Label templates
     LABEL_TEMPLATE_FILENAME = "labels.svg"
     DEFAULT_LABELS_PER_SHEET = 30
 
-    def __init__(self, labels_per_sheet=None, output_dir=None):
+    def __init__(
+        self,
+        labels_per_sheet=None,
+        output_dir=None,
+        offline=False,
+        catalog_ttl=None,
+        jobs=1,
+        keep_svg=False,
+        keep_pages=False,
+        renderer=None,
+        sheet=None,
+        incremental=False,
+        split_pages=None,
+        output_format=None,
+        dpi=None,
+        profile=None,
+        profile_stage=None,
+        record=None,
+        replay=None,
+        resources=None,
+        set_filter=None,
+    ):
         """
         Initialize the LabelGenerator.
 
         Args:
-            labels_per_sheet (int): The number of labels per sheet.
+            labels_per_sheet (int): The number of labels per US Letter sheet.
             output_dir (str): The output directory for the generated labels. Defaults to DEFAULT_OUTPUT_DIR.
+            offline (bool): Only use cached catalogs and icons.
+            catalog_ttl (int): Seconds a cached catalog is used before revalidation. Defaults to config.CATALOG_TTL.
+            jobs (int): Number of worker processes used to render pages.
+            keep_svg (bool): Write the rendered SVG of every page to the output directory.
+            keep_pages (bool): Write the PDF of every page to the output directory.
+            renderer (str): The renderer backend, one of config.RENDERERS.
+            sheet (SheetSpec): The sheet geometry. Overrides labels_per_sheet.
+            incremental (bool): Only re-render pages whose contents changed since the last run.
+            split_pages (int): Split the combined PDF into files of at most this many pages.
+            output_format (str): Write the combined PDF, a PNG of every page or both, one of config.OUTPUT_FORMATS.
+            dpi (int): The resolution of the page PNGs. Defaults to config.PNG_DPI.
+            profile (str): Write a JSON report of stage timings, page render times and counters to this path.
+            profile_stage (str): Run this stage under cProfile, dumping the statistics next to the report.
+            record (str): Save every Scryfall response to this directory.
+            replay (str): Serve Scryfall responses from a directory saved with ``record`` instead of the network.
+            resources (Resources): Caches and render pool shared with other generators, e.g. by a batch run. Overrides offline, catalog_ttl, record and replay.
+            set_filter (SetFilter): Predicates selecting the sets, e.g. a release date range. Defaults to the configured set filters.
         """
         self.set_codes = []
-        self.labels_per_sheet = labels_per_sheet or self.DEFAULT_LABELS_PER_SHEET
+        self.sheet = sheet or sheet_for(
+            labels_per_sheet or self.DEFAULT_LABELS_PER_SHEET
+        )
+        self.labels_per_sheet = self.sheet.labels_per_sheet
         self.output_dir = Path(output_dir or self.DEFAULT_OUTPUT_DIR)
+        self.offset_y = self.OFFSET_Y
 
-        self.tmp_svg_dir = None
         self.setup_directories()
 
-        self.delta_y = None
-        self.delta_x = None
-        self.calculate_label_dimensions()
+        self.offline = offline
+        # The catalog, icon and render stages pull in requests, cairosvg and
+        # PyPDF2; they are imported only once the arguments are validated, so
+        # --help and argument errors return without loading them
+        from mtglabels.profiling import Profiler
+        from mtglabels.resources import Resources
+        from mtglabels.setdb import SetFilter
+
+        self.set_filter = set_filter or SetFilter()
+        self.resources = resources or Resources(
+            offline=offline, catalog_ttl=catalog_ttl, record=record, replay=replay
+        )
+        self.session = self.resources.session
+        self.catalog = self.resources.catalog
+        self.icon_cache = self.resources.icon_cache
+        self.icon_library = self.resources.icon_library
+        self.jobs = jobs
+        self.keep_svg = keep_svg
+        self.keep_pages = keep_pages
+        self.renderer = renderer or config.DEFAULT_RENDERER
+        self.incremental = incremental
+        self.split_pages = split_pages
+        self.output_format = output_format or config.DEFAULT_FORMAT
+        self.dpi = dpi or config.PNG_DPI
+        self.raster_cache = None
+        self.profile = profile
+        self.profiler = Profiler(profile_stage)
 
     def setup_directories(self):
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.tmp_svg_dir = Path("/tmp/mtglabels/svg")
-        self.tmp_svg_dir.mkdir(parents=True, exist_ok=True)
-
-    def calculate_label_dimensions(self):
-        self.delta_x = (config.LETTER_WIDTH - (2 * self.MARGIN)) / 3 + 10
-        self.delta_y = (config.LETTER_HEIGHT - (2 * self.MARGIN)) / (
-            self.labels_per_sheet / 3
-        ) - 18
 
     def generate_labels(self, sets=None):
         """
@@ -102,86 +127,125 @@ class LabelGenerator:
         Args:
             sets (list): List of set codes to include. If None, all sets will be included.
         """
-        # Clean up any existing PDF files in the output directory
-        clean_up_pdfs(self.output_dir)
+        from mtglabels.render import (
+            PageRenderer,
+            RasterCache,
+            clean_up_pdfs,
+            combine_pdfs,
+        )
+
+        # Clean up any existing PDF files in the output directory, unless they
+        # are reused by an incremental run
+        if not self.incremental:
+            clean_up_pdfs(self.output_dir)
+            clean_up_pdfs(self.output_dir, "combined_labels*.pdf")
+        # Page PNGs are always written again, from the raster cache when the
+        # page did not change
+        clean_up_pdfs(self.output_dir, "labels-*.png")
+
+        self.use_sets(sets)
+
+        # Pages are rendered as soon as their labels are ready, while icons for
+        # later pages are still downloading
+        label_batches = self.sheet.pages(self.create_set_label_data(), self.offset_y)
+
+        context = {"WIDTH": self.sheet.width, "HEIGHT": self.sheet.height}
+        if self.output_format != "pdf":
+            self.raster_cache = RasterCache()
+        renderer = PageRenderer(
+            self.LABEL_TEMPLATE_FILENAME,
+            self.output_dir,
+            f"labels-{self.labels_per_sheet}",
+            jobs=self.jobs,
+            keep_svg=self.keep_svg,
+            keep_pages=self.keep_pages,
+            icon_library=self.icon_library,
+            profiler=self.profiler,
+            executor=self.resources.executor,
+            raster_cache=self.raster_cache,
+            dpi=self.dpi,
+        )
+        if self.output_format == "png":
+            with self.profiler.stage("render"):
+                renderer.render_png(label_batches, context)
+        elif self.incremental:
+            if self.renderer == "single-pass":
+                log.warning("Incremental runs use the merge renderer")
+            with self.profiler.stage("render"):
+                renderer.render_incremental(
+                    label_batches,
+                    context,
+                    self.output_dir / "combined_labels.pdf",
+                    self.split_pages,
+                )
+        elif self.renderer == "single-pass":
+            with self.profiler.stage("render"):
+                renderer.render_document(
+                    label_batches,
+                    context,
+                    self.output_dir / "combined_labels.pdf",
+                    self.split_pages,
+                )
+        else:
+            # Every page is merged as soon as it is rendered, instead of
+            # holding all page PDFs until the last one is done
+            pages = self.profiler.iterate(
+                "render", renderer.iter_render(label_batches, context)
+            )
+            with self.profiler.stage("combine"):
+                combine_pdfs(self.output_dir, pages, self.split_pages)
 
+        if self.profile:
+            self.write_profile()
+
+    def use_sets(self, sets=None):
+        """
+        Only select the specified sets, bypassing the configured set filters.
+
+        Args:
+            sets (list): List of set codes to include. If None, the configured set filters apply.
+        """
         if sets:
             config.IGNORED_SETS = ()
             config.MINIMUM_SET_SIZE = 0
             config.SET_TYPES = ()
             self.set_codes = [exp.lower() for exp in sets]
 
-        page = 1
-        labels = self.create_set_label_data()
-        label_batches = [
-            labels[i : i + self.labels_per_sheet]
-            for i in range(0, len(labels), self.labels_per_sheet)
-        ]
-
-        template_name = self.LABEL_TEMPLATE_FILENAME  # Use the defined constant
-
-        template = ENV.get_template(template_name)
-        for batch in label_batches:
-            output = template.render(
-                labels=batch, WIDTH=config.LETTER_WIDTH, HEIGHT=config.LETTER_HEIGHT
-            )
-            outfile_svg = (
-                self.output_dir / f"labels-{self.labels_per_sheet}-{page:02}.svg"
-            )
-            outfile_pdf = (
-                self.output_dir / f"labels-{self.labels_per_sheet}-{page:02}.pdf"
-            )
-
-            log.info(f"Writing {outfile_svg}...")
-            with outfile_svg.open("w") as fd:
-                fd.write(output)
-
-            log.info(f"Writing {outfile_pdf}...")
-            cairosvg.svg2pdf(
-                url=str(outfile_svg), write_to=str(outfile_pdf), unsafe=True
-            )
-
-            page += 1
-
-        combine_pdfs(self.output_dir)
+    def write_profile(self):
+        """
+        Write the profiling report of the run, including the cache counters
+        and the size of the combined PDFs.
+        """
+        self.profiler.record("catalog", self.catalog.counters())
+        self.profiler.record("icons", self.icon_cache.counters())
+        if self.raster_cache is not None:
+            self.profiler.record("raster", self.raster_cache.counters())
+        self.profiler.record(
+            "output_bytes",
+            {
+                path.name: path.stat().st_size
+                for path in sorted(self.output_dir.glob("combined_labels*.pdf"))
+            },
+        )
+        self.profiler.write(self.profile)
 
     def get_set_data(self):
         """
-        Fetch set data from Scryfall API.
+        Select the sets from the set database, synced with the Scryfall API.
 
         Returns:
             list: List of set data dictionaries.
         """
 
+        import requests
+
         try:
             log.info("Getting set data and icons from Scryfall")
 
-            resp = session.get(config.API_ENDPOINT + '/sets')
-            resp.raise_for_status()
-
-            data = resp.json().get("data", [])
-
-            known_sets = {exp["code"] for exp in data}
-            specified_sets = (
-                {code.lower() for code in self.set_codes} if self.set_codes else set()
+            self.resources.sync_sets()
+            return self.resources.set_db.select(
+                replace(self.set_filter, codes=tuple(self.set_codes))
             )
-            unknown_sets = specified_sets - known_sets
-
-            if unknown_sets:
-                log.warning("Unknown sets: %s", ", ".join(unknown_sets))
-
-            set_data = [
-                exp
-                for exp in data
-                if (
-                    exp["code"] not in config.IGNORED_SETS
-                    and exp["card_count"] >= config.MINIMUM_SET_SIZE
-                    and (not config.SET_TYPES or exp["set_type"] in config.SET_TYPES)
-                    and (not self.set_codes or exp["code"].lower() in specified_sets)
-                )
-            ]
-
-            return set_data
 
         except requests.exceptions.RequestException as e:
             log.error("Error occurred while fetching set data: %s", str(e))
@@ -191,92 +255,48 @@ class LabelGenerator:
         """
         Create label data for the sets.
 
-        Returns:
-            list: List of label data dictionaries.
+        Labels are produced as soon as their icon is available, while the
+        icons of later labels are still downloading.
+
+        Yields:
+            dict: Label data dictionaries, without coordinates.
         """
-        labels = []
-        x = self.START_X
-        y = self.START_Y
+        with self.profiler.stage("catalog"):
+            set_data = list(reversed(self.get_set_data()))
 
-        set_data = self.get_set_data()
+        icons = self.icon_cache.stream(
+            self.session, [exp["icon_svg_uri"] for exp in set_data]
+        )
+        icon_paths = {}
 
-        for exp in reversed(set_data):
-            name = config.RENAME_SETS.get(exp["name"], exp["name"])
+        for exp in set_data:
             icon_url = exp["icon_svg_uri"]
-            filename = Path(icon_url).name.split("?")[0]
-            file_path = self.tmp_svg_dir / filename
-
-            if file_path.exists():
-                log.debug(f"Skipping download. File already exists: {icon_url}")
-                icon_filename = filename
-            else:
-                try:
-                    response = session.get(icon_url)
-                    response.raise_for_status()
-                    with file_path.open("wb") as file:
-                        file.write(response.content)
-                    icon_filename = filename
-                except requests.exceptions.RequestException as e:
-                    log.error(f"Failed to download file: {icon_url}")
-                    log.error("Error occurred while downloading file: %s", str(e))
-                    icon_filename = None
-
-            if icon_filename:
-                shutil.copy(file_path, self.output_dir)
-                labels.append(
-                    {
-                        "name": name,
-                        "code": exp["code"],
-                        "date": datetime.strptime(
-                            exp["released_at"], "%Y-%m-%d"
-                        ).date(),
-                        "icon_filename": icon_filename,
-                        "x": x,
-                        "y": y,
-                    }
+            with self.profiler.stage("icons"):
+                # The stream reports every distinct icon once, in label order
+                while icon_url not in icon_paths:
+                    url, file_path = next(icons)
+                    icon_paths[url] = file_path
+
+            with self.profiler.stage("layout"):
+                name = config.RENAME_SETS.get(exp["name"], exp["name"])
+                icon_id = (
+                    self.icon_library.add(icon_paths[icon_url])
+                    if icon_paths[icon_url]
+                    else None
                 )
 
-            y += self.delta_y
-
-            # Start a new column if needed
-            if len(labels) % (self.labels_per_sheet / 3) == 0:
-                x += self.delta_x
-                y = self.START_Y
-
-            # Start a new page if needed
-            if len(labels) % self.labels_per_sheet == 0:
-                x = self.START_X
-                y = self.START_Y
-
-        return labels
-
-
-def combine_pdfs(output_dir):
-    pdf_merger = PyPDF2.PdfMerger()
-
-    # List all PDF files in the output directory that match your naming pattern
-    pdf_files = sorted(output_dir.glob("labels-*.pdf"))
-
-    for pdf_file in pdf_files:
-        pdf_merger.append(str(pdf_file))
+            if icon_id:
+                yield {
+                    "name": name,
+                    "code": exp["code"],
+                    "date": datetime.strptime(exp["released_at"], "%Y-%m-%d").date(),
+                    "icons": [icon_id],
+                }
 
-    # Output combined PDF
-    combined_pdf_path = output_dir / "combined_labels.pdf"
-    with combined_pdf_path.open("wb") as combined_pdf:
-        pdf_merger.write(combined_pdf)
-        log.info(f"Writing {combined_pdf_path}...")
-
-
-def clean_up_pdfs(output_dir, pattern="labels-*.pdf"):
-    # List all PDF files in the output directory that match the specified pattern
-    pdf_files = sorted(output_dir.glob(pattern))
-
-    for pdf_file in pdf_files:
-        try:
-            pdf_file.unlink()
-            log.info(f"Deleted {pdf_file}")
-        except Exception as e:
-            log.error(f"Error deleting {pdf_file}: {e}")
+        # Drain the stream, so the icon cache index is updated
+        with self.profiler.stage("icons"):
+            for _ in icons:
+                pass
 
 
 def parse_arguments():
@@ -299,6 +319,170 @@ def parse_arguments():
         choices=[24, 30],
         help="Number of labels per sheet (default: 30)",
     )
+    parser.add_argument(
+        "--sheet",
+        type=sheet_argument,
+        help=(
+            "Sheet geometry, overrides --labels-per-sheet: one of "
+            f"{', '.join(SHEETS)}, or custom key=value pairs such as "
+            "rows=8,cols=3,width=2100,height=2970,margin=40 (in 1/10 mm)"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Render pages in this many worker processes (default: 1)",
+    )
+    parser.add_argument(
+        "--renderer",
+        default=config.DEFAULT_RENDERER,
+        choices=config.RENDERERS,
+        help=(
+            "merge: convert pages separately (supports --jobs) and merge them; "
+            "single-pass: draw all pages into one PDF "
+            f"(default: {config.DEFAULT_RENDERER})"
+        ),
+    )
+    parser.add_argument(
+        "--keep-svg",
+        action="store_true",
+        help="Also write the SVG of every page to the output directory",
+    )
+    parser.add_argument(
+        "--keep-pages",
+        action="store_true",
+        help="Also write the PDF of every page to the output directory",
+    )
+    parser.add_argument(
+        "--split-pages",
+        type=int,
+        metavar="N",
+        help=(
+            "Split the combined PDF into combined_labels-001.pdf, "
+            "combined_labels-002.pdf, ... of at most N pages each; this also "
+            "bounds memory, as an unsplit PDF holds every page until it is written"
+        ),
+    )
+    parser.add_argument(
+        "--format",
+        dest="output_format",
+        default=config.DEFAULT_FORMAT,
+        choices=config.OUTPUT_FORMATS,
+        help=(
+            "pdf: write the combined PDF; png: write a labels-NN.png of every "
+            f"page; both: write both (default: {config.DEFAULT_FORMAT})"
+        ),
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=config.PNG_DPI,
+        help=(
+            "Resolution of the page PNGs, e.g. 30 for thumbnails "
+            f"(default: {config.PNG_DPI})"
+        ),
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            "Keep page PDFs and a manifest of their content hashes in the output "
+            "directory, and only re-render pages that changed"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="REPORT",
+        help=(
+            "Write a JSON report with per-stage wall time, per-page render times, "
+            "bytes downloaded, cache hits and peak memory to this file"
+        ),
+    )
+    parser.add_argument(
+        "--profile-stage",
+        choices=STAGES,
+        help="Also run this stage under cProfile, writing REPORT.pstats",
+    )
+    selection = parser.add_argument_group(
+        "set selection",
+        "Select sets from the local set database; these options override the "
+        "set filters in config",
+    )
+    selection.add_argument(
+        "--released-after",
+        type=date.fromisoformat,
+        metavar="DATE",
+        help="Only output sets released on or after DATE (YYYY-MM-DD)",
+    )
+    selection.add_argument(
+        "--released-before",
+        type=date.fromisoformat,
+        metavar="DATE",
+        help="Only output sets released on or before DATE (YYYY-MM-DD)",
+    )
+    selection.add_argument(
+        "--set-type",
+        action="append",
+        dest="set_types",
+        metavar="TYPE",
+        help=(
+            "Only output sets of this type (e.g., expansion). "
+            "This can be used multiple times."
+        ),
+    )
+    selection.add_argument(
+        "--min-cards",
+        type=int,
+        metavar="N",
+        help=(
+            "Only output sets of at least N cards "
+            f"(default: {config.MINIMUM_SET_SIZE})"
+        ),
+    )
+    selection.add_argument(
+        "--parent",
+        metavar="SET",
+        help="Only output sets whose parent set is SET (e.g., the promos of a set)",
+    )
+    selection.add_argument(
+        "--digital",
+        action=argparse.BooleanOptionalAction,
+        help="Only output digital (--digital) or paper (--no-digital) sets",
+    )
+    selection.add_argument(
+        "--list-sets",
+        action="store_true",
+        help="List the selected sets instead of generating labels",
+    )
+    http = parser.add_mutually_exclusive_group()
+    http.add_argument(
+        "--record",
+        metavar="DIR",
+        help="Save every Scryfall response (catalogs and icons) to DIR",
+    )
+    http.add_argument(
+        "--replay",
+        metavar="DIR",
+        help=(
+            "Serve Scryfall responses recorded with --record from DIR "
+            "instead of the network"
+        ),
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached catalogs and icons; never touch the network",
+    )
+    parser.add_argument(
+        "--catalog-ttl",
+        type=int,
+        default=config.CATALOG_TTL,
+        help=(
+            "Seconds a cached catalog is used before it is revalidated "
+            f"(default: {config.CATALOG_TTL})"
+        ),
+    )
     parser.add_argument(
         "sets",
         nargs="*",
@@ -312,14 +496,69 @@ def parse_arguments():
     return parser.parse_args()
 
 
+# Subcommands of the ``mtglabels`` entry point, dispatched before the label
+# generation arguments are parsed
+SUBCOMMANDS = {
+    "cache": "mtglabels.cache",
+    "batch": "mtglabels.batch",
+    "serve": "mtglabels.serve",
+    "optimize": "mtglabels.svgopt",
+}
+
+
 def main():
     """
     Main function for running the label generation.
     """
 
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        command = importlib.import_module(SUBCOMMANDS[sys.argv[1]])
+        sys.exit(command.main(sys.argv[2:]))
+
+    args = parse_arguments()
+
+    import requests
+
+    from mtglabels.setdb import SetFilter
+
+    set_filter = SetFilter(
+        released_after=args.released_after,
+        released_before=args.released_before,
+        set_types=tuple(args.set_types) if args.set_types else None,
+        min_cards=args.min_cards,
+        parent=args.parent,
+        digital=args.digital,
+    )
+
     try:
-        args = parse_arguments()
-        generator = LabelGenerator(args.labels_per_sheet, args.output_dir)
+        generator = LabelGenerator(
+            args.labels_per_sheet,
+            args.output_dir,
+            offline=args.offline,
+            catalog_ttl=args.catalog_ttl,
+            jobs=args.jobs,
+            keep_svg=args.keep_svg,
+            keep_pages=args.keep_pages,
+            renderer=args.renderer,
+            sheet=args.sheet,
+            incremental=args.incremental,
+            split_pages=args.split_pages,
+            output_format=args.output_format,
+            dpi=args.dpi,
+            profile=args.profile,
+            profile_stage=args.profile_stage,
+            record=args.record,
+            replay=args.replay,
+            set_filter=set_filter,
+        )
+        if args.list_sets:
+            generator.use_sets(args.sets)
+            for exp in generator.get_set_data():
+                print(
+                    f"{exp['code']:<6} {exp['released_at'] or '':<10} "
+                    f"{exp['set_type']:<16} {exp['card_count']:>5}  {exp['name']}"
+                )
+            return
         generator.generate_labels(args.sets)
     except requests.exceptions.RequestException as e:
         log.error("Error occurred while making a request: %s", str(e))
@@ -0,0 +1,556 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+import mtglabels.config as config
+from mtglabels.catalog import locked, unique_part_path, write_atomic
+
+log = logging.getLogger(__name__)
+
+# Size of the chunks streamed from the response body to disk
+CHUNK_SIZE = 64 * 1024
+
+SVG_NS = "{http://www.w3.org/2000/svg}"
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+# Attributes of the icon's root <svg> that are not carried over to its <symbol>
+ROOT_ATTRIBUTES = {
+    "id",
+    "x",
+    "y",
+    "width",
+    "height",
+    "viewBox",
+    "version",
+    "baseProfile",
+}
+
+
+def download_icon(session, icon_url, file_path):
+    """
+    Stream a single icon to disk.
+
+    The body is written to a temporary ``.part`` file first and moved into
+    place once complete, so an interrupted download never leaves a truncated
+    icon behind in the cache. The temporary file is unique to the process and
+    thread, as another process sharing the cache may download the same icon.
+
+    Args:
+        session (requests.Session): The session used to perform the request.
+        icon_url (str): The URL of the icon.
+        file_path (Path): Where to store the icon.
+
+    Returns:
+        bool: True if the icon was downloaded successfully.
+    """
+    part_path = unique_part_path(file_path)
+
+    try:
+        with session.get(icon_url, stream=True) as response:
+            response.raise_for_status()
+            with part_path.open("wb") as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+        part_path.replace(file_path)
+        return True
+    except (requests.exceptions.RequestException, OSError) as e:
+        log.error(f"Failed to download file: {icon_url}")
+        log.error("Error occurred while downloading file: %s", str(e))
+        part_path.unlink(missing_ok=True)
+        return False
+
+
+def stream_icons(session, downloads, max_workers=None, offline=False):
+    """
+    Download every missing icon using a bounded pool of worker threads,
+    reporting each icon as soon as it and every icon before it are available.
+
+    Downloads are started in order and keep running in the background while
+    the caller works on the icons reported so far.
+
+    Args:
+        session (requests.Session): The session used to perform the requests.
+        downloads (dict): Mapping of icon URL to the local file path.
+        max_workers (int): Maximum number of concurrent downloads.
+            Defaults to config.DOWNLOAD_WORKERS.
+        offline (bool): Do not download anything; missing icons are reported
+            as failures.
+
+    Yields:
+        tuple: (icon URL, True if the icon is available), in the order of ``downloads``.
+    """
+    missing = {}
+    for icon_url, file_path in downloads.items():
+        if file_path.exists():
+            log.debug(f"Skipping download. File already exists: {icon_url}")
+        else:
+            missing[icon_url] = file_path
+
+    if missing and offline:
+        for icon_url in missing:
+            log.error(f"Failed to download file: {icon_url}")
+            log.error("Icon is not cached and --offline is set")
+    elif missing:
+        log.info(f"Downloading {len(missing)} icons...")
+
+    with ThreadPoolExecutor(max_workers or config.DOWNLOAD_WORKERS) as executor:
+        futures = {}
+        if not offline:
+            futures = {
+                icon_url: executor.submit(download_icon, session, icon_url, file_path)
+                for icon_url, file_path in missing.items()
+            }
+
+        for icon_url in downloads:
+            if icon_url in futures:
+                yield icon_url, futures[icon_url].result()
+            else:
+                yield icon_url, icon_url not in missing
+
+
+class IconCache:
+    """
+    Size-bounded, least-recently-used cache of downloaded icons.
+
+    Icons are keyed by their full URL, including Scryfall's ``?<timestamp>``
+    version stamp, so an updated icon is stored under a new key and fetched
+    again. An index file tracks the size and last use of every entry together
+    with cumulative hit/miss counters.
+
+    Downloaded icons are optimized once (see mtglabels/svgopt.py) and the
+    optimized copies, kept in ``optimized`` and keyed by content hash, are
+    what the cache hands out.
+
+    Several processes may share the cache directory, e.g. a cron job and
+    ``mtglabels serve``. The index is merged with the one on disk under a
+    file lock when it is saved, and files that are not in the index are
+    only removed once they are older than STRAY_GRACE_SECONDS, so the
+    downloads of another process are left alone.
+    """
+
+    INDEX_FILENAME = "index.json"
+    LOCK_FILENAME = "index.lock"
+    OPTIMIZED_DIRNAME = "optimized"
+
+    # Age after which files not in the index are removed by prune()
+    STRAY_GRACE_SECONDS = 60 * 60
+
+    def __init__(self, cache_dir=None, max_bytes=None, offline=False, optimize=None):
+        """
+        Initialize the IconCache.
+
+        Args:
+            cache_dir (str): Directory holding the cached icons. Defaults to CACHE_DIR/icons.
+            max_bytes (int): Size cap of the cache. Defaults to config.ICON_CACHE_MAX_BYTES.
+            offline (bool): Never download; icons missing from the cache are reported as failures.
+            optimize (bool): Hand out optimized icons. Defaults to config.OPTIMIZE_ICONS.
+        """
+        from mtglabels.svgopt import SvgOptimizer
+
+        self.cache_dir = Path(cache_dir or Path(config.CACHE_DIR) / "icons")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = config.ICON_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.offline = offline
+        optimize = config.OPTIMIZE_ICONS if optimize is None else optimize
+        self.optimizer = (
+            SvgOptimizer(self.cache_dir / self.OPTIMIZED_DIRNAME) if optimize else None
+        )
+
+        # Counters for this run; cumulative counters are kept in the index
+        self.hits = 0
+        self.misses = 0
+        self.downloaded_bytes = 0
+
+        self.lock = threading.Lock()
+        self.index = self.load_index()
+        # Keys removed since the index was loaded, and the cumulative
+        # counters as last loaded, for merging with the index on disk
+        self.removed = set()
+        self.saved_counters = self.index["hits"], self.index["misses"]
+
+    @staticmethod
+    def key(icon_url):
+        """
+        Get the cache key (file name) of an icon URL.
+
+        The key keeps the icon name readable and appends a digest of the full
+        URL, so different versions of the same icon never collide.
+        """
+        name = Path(urlparse(icon_url).path)
+        digest = hashlib.sha1(icon_url.encode()).hexdigest()[:12]
+        return f"{name.stem}-{digest}{name.suffix}"
+
+    def path_for(self, icon_url):
+        return self.cache_dir / self.key(icon_url)
+
+    def load_index(self):
+        try:
+            with (self.cache_dir / self.INDEX_FILENAME).open() as fd:
+                index = json.load(fd)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        index.setdefault("hits", 0)
+        index.setdefault("misses", 0)
+        return index
+
+    def save(self):
+        """
+        Write the index, merged with the index on disk.
+
+        Entries other processes added are kept unless this process removed
+        them, the most recent use of every entry wins, and the hits and
+        misses of this process are added to the counters on disk.
+        """
+        with locked(self.cache_dir / self.LOCK_FILENAME):
+            index = self.load_index()
+            with self.lock:
+                entries = index["entries"]
+                for key in self.removed:
+                    entries.pop(key, None)
+                for key, entry in self.index["entries"].items():
+                    if entry["last_used"] >= entries.get(key, {}).get("last_used", 0):
+                        entries[key] = entry
+                hits, misses = self.saved_counters
+                index["hits"] += self.index["hits"] - hits
+                index["misses"] += self.index["misses"] - misses
+
+                self.index = index
+                self.removed = set()
+                self.saved_counters = index["hits"], index["misses"]
+                data = json.dumps(index).encode()
+            write_atomic(self.cache_dir / self.INDEX_FILENAME, data)
+
+    def touch(self, icon_url, file_path, optimized=None):
+        with self.lock:
+            entry = self.index["entries"].get(file_path.name, {})
+            if optimized is not None:
+                entry["optimized"] = optimized
+            # The size of an entry includes its optimized copy
+            size = file_path.stat().st_size
+            if entry.get("optimized") and self.optimizer:
+                optimized_path = self.optimizer.path_for(entry["optimized"])
+                if optimized_path.exists():
+                    size += optimized_path.stat().st_size
+            entry.update(url=icon_url, size=size, last_used=time.time())
+            self.index["entries"][file_path.name] = entry
+
+    def optimized_path(self, file_path):
+        """
+        Get the optimized copy of a cached icon, optimizing it unless done
+        before.
+
+        Returns:
+            tuple: (path handed out for the icon, digest of the optimized copy or None)
+        """
+        if self.optimizer is None:
+            return file_path, None
+        digest = self.index["entries"].get(file_path.name, {}).get("optimized")
+        if digest and self.optimizer.path_for(digest).exists():
+            return self.optimizer.path_for(digest), digest
+        return self.optimizer.optimize(file_path)
+
+    def fetch(self, session, icon_urls, max_workers=None):
+        """
+        Get local paths for a list of icons, downloading the ones not cached.
+
+        Args:
+            session (requests.Session): The session used to perform the requests.
+            icon_urls (iterable): The icon URLs.
+            max_workers (int): Maximum number of concurrent downloads.
+
+        Returns:
+            tuple: (dict of icon URL to local path, set of URLs that could not be downloaded)
+        """
+        icon_paths = {}
+        failed = set()
+        for icon_url, file_path in self.stream(session, icon_urls, max_workers):
+            if file_path is None:
+                failed.add(icon_url)
+                file_path = self.path_for(icon_url)
+            icon_paths[icon_url] = file_path
+        return icon_paths, failed
+
+    def stream(self, session, icon_urls, max_workers=None):
+        """
+        Get local paths for a list of icons, downloading the ones not cached,
+        and report every icon as soon as it is available.
+
+        Icons are downloaded in order in the background, so the caller can
+        work on the first icons while later ones are still downloading, and
+        are optimized as they are reported. The cache index is updated once
+        the stream is exhausted.
+
+        Args:
+            session (requests.Session): The session used to perform the requests.
+            icon_urls (iterable): The icon URLs.
+            max_workers (int): Maximum number of concurrent downloads.
+
+        Yields:
+            tuple: (icon URL, local path or None if it could not be downloaded),
+            once per distinct URL, in order.
+        """
+        paths = {icon_url: self.path_for(icon_url) for icon_url in icon_urls}
+        cached = {
+            icon_url for icon_url, file_path in paths.items() if file_path.exists()
+        }
+        hits = len(cached)
+        optimized = self.optimizer.counters() if self.optimizer else {}
+
+        for icon_url, ok in stream_icons(
+            session, paths, max_workers, offline=self.offline
+        ):
+            file_path = paths[icon_url]
+            if not ok:
+                yield icon_url, None
+                continue
+            icon_path, digest = self.optimized_path(file_path)
+            self.touch(icon_url, file_path, digest)
+            if icon_url not in cached:
+                self.downloaded_bytes += file_path.stat().st_size
+            yield icon_url, icon_path
+
+        self.hits += hits
+        self.misses += len(paths) - hits
+        self.index["hits"] += hits
+        self.index["misses"] += len(paths) - hits
+        log.info(f"Icon cache: {hits} hits, {len(paths) - hits} misses")
+        if self.optimizer and self.optimizer.optimized > optimized["optimized"]:
+            log.info(
+                f"Optimized {self.optimizer.optimized - optimized['optimized']} "
+                "icons, saving "
+                f"{self.optimizer.saved_bytes - optimized['saved_bytes']} bytes"
+            )
+
+        self.prune(protect={file_path.name for file_path in paths.values()})
+        self.save()
+
+    def counters(self):
+        """
+        Get the counters of this run.
+
+        Returns:
+            dict: Cache hits and misses, the number of bytes downloaded, and
+            the number of icons optimized and bytes saved by optimizing them.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "downloaded_bytes": self.downloaded_bytes,
+            **(self.optimizer.counters() if self.optimizer else {}),
+        }
+
+    def stats(self):
+        """
+        Get statistics of the cache.
+
+        Returns:
+            dict: Entry count, total size, size cap and cumulative hit/miss counters.
+        """
+        entries = self.index["entries"]
+        return {
+            "directory": str(self.cache_dir),
+            "entries": len(entries),
+            "size": sum(entry["size"] for entry in entries.values()),
+            "max_size": self.max_bytes,
+            "hits": self.index["hits"],
+            "misses": self.index["misses"],
+        }
+
+    def prune(self, max_bytes=None, protect=()):
+        """
+        Evict least recently used icons until the cache fits its size cap.
+
+        Stray files that are not in the index (for example interrupted
+        downloads) and optimized copies no entry refers to are removed as
+        well once they are older than STRAY_GRACE_SECONDS, and so are index
+        entries whose file is gone.
+
+        Args:
+            max_bytes (int): Size cap to prune to. Defaults to the cache's size cap.
+            protect (set): Keys that must not be evicted, e.g. icons used by the current run.
+
+        Returns:
+            tuple: (number of removed files, number of freed bytes)
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.index["entries"]
+        removed = freed = 0
+        # Files of other processes sharing the cache directory may not be in
+        # this index yet, and may vanish while the directory is scanned
+        stray_before = time.time() - self.STRAY_GRACE_SECONDS
+
+        def remove_stray(file_path):
+            """Remove a stray file unless it is recent; returns its size or None."""
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                return None
+            if stat.st_mtime > stray_before:
+                return None
+            file_path.unlink(missing_ok=True)
+            return stat.st_size
+
+        for key in [key for key in entries if not (self.cache_dir / key).exists()]:
+            del entries[key]
+            self.removed.add(key)
+
+        reserved = {self.INDEX_FILENAME, self.LOCK_FILENAME, self.OPTIMIZED_DIRNAME}
+        for file_path in self.cache_dir.iterdir():
+            if file_path.name in reserved or file_path.name in entries:
+                continue
+            size = remove_stray(file_path)
+            if size is not None:
+                freed += size
+                removed += 1
+
+        size = sum(entry["size"] for entry in entries.values())
+        evicted = set()
+        for key, entry in sorted(
+            entries.items(), key=lambda item: item[1]["last_used"]
+        ):
+            if size <= max_bytes:
+                break
+            if key in protect:
+                continue
+            (self.cache_dir / key).unlink(missing_ok=True)
+            del entries[key]
+            self.removed.add(key)
+            evicted.add(entry.get("optimized"))
+            size -= entry["size"]
+            freed += entry["size"]
+            removed += 1
+
+        optimized_dir = self.cache_dir / self.OPTIMIZED_DIRNAME
+        if optimized_dir.is_dir():
+            digests = {entry.get("optimized") for entry in entries.values()}
+            for file_path in optimized_dir.iterdir():
+                digest = file_path.name.removesuffix(".svg")
+                if digest in digests:
+                    continue
+                if digest in evicted:
+                    # The size of an evicted entry includes its optimized copy
+                    file_path.unlink(missing_ok=True)
+                else:
+                    freed += remove_stray(file_path) or 0
+
+        if removed:
+            log.info(f"Pruned {removed} icons ({freed} bytes) from {self.cache_dir}")
+        return removed, freed
+
+
+class IconLibrary:
+    """
+    Inlines SVG icons into label sheets as ``<symbol>`` definitions.
+
+    Every icon file is parsed once per run. Pages then define each icon they
+    use once in their ``<defs>`` and reference it with ``<use>``, instead of
+    having cairosvg open and parse the icon file for every label.
+    """
+
+    def __init__(self):
+        self.ids = {}  # icon path -> symbol id
+        self.symbols = {}  # symbol id -> <symbol> markup
+
+    def add(self, file_path):
+        """
+        Add an icon to the library.
+
+        Args:
+            file_path (Path): The path of the SVG icon.
+
+        Returns:
+            str: The symbol id of the icon, or None if it could not be parsed.
+        """
+        file_path = Path(file_path)
+        if file_path not in self.ids:
+            symbol_id = "icon-" + re.sub(r"[^A-Za-z0-9_-]", "_", file_path.stem)
+            try:
+                self.symbols[symbol_id] = parse_symbol(file_path, symbol_id)
+                self.ids[file_path] = symbol_id
+            except (OSError, ET.ParseError) as e:
+                log.error(f"Failed to parse icon: {file_path}")
+                log.error("Error occurred while parsing icon: %s", str(e))
+                self.ids[file_path] = None
+        return self.ids[file_path]
+
+    def defs(self, labels):
+        """
+        Get the symbol definitions used by a page of labels.
+
+        Args:
+            labels (list): List of label data dictionaries with an ``icons`` list of symbol ids.
+
+        Returns:
+            list: ``<symbol>`` markup of every distinct icon on the page.
+        """
+        icon_ids = dict.fromkeys(
+            icon_id for label in labels for icon_id in label.get("icons", ())
+        )
+        return [self.symbols[icon_id] for icon_id in icon_ids]
+
+
+def parse_symbol(file_path, symbol_id):
+    """
+    Convert an SVG icon into a ``<symbol>`` definition.
+
+    Ids inside the icon are prefixed with the symbol id so that icons sharing
+    a page cannot clash, and elements and attributes from foreign namespaces
+    (editor metadata) are dropped.
+
+    Returns:
+        str: The ``<symbol>`` markup.
+    """
+    root = ET.parse(file_path).getroot()
+
+    symbol = ET.Element("symbol")
+    view_box = root.get("viewBox")
+    if not view_box and root.get("width") and root.get("height"):
+        width, height = (
+            re.sub(r"[a-z%]+$", "", root.get(name)) for name in ("width", "height")
+        )
+        view_box = f"0 0 {width} {height}"
+    if view_box:
+        symbol.set("viewBox", view_box)
+    for name, value in root.attrib.items():
+        if name not in ROOT_ATTRIBUTES and not name.startswith("{"):
+            symbol.set(name, value)
+
+    symbol.extend(root)
+    localize(symbol, symbol_id + "-")
+    symbol.set("id", symbol_id)
+
+    return ET.tostring(symbol, encoding="unicode")
+
+
+def localize(element, prefix):
+    """
+    Strip the SVG namespace from ``element`` and its children and prefix their ids.
+    """
+    for child in list(element):
+        if child.tag.startswith("{") and not child.tag.startswith(SVG_NS):
+            element.remove(child)
+        else:
+            localize(child, prefix)
+
+    element.tag = element.tag.removeprefix(SVG_NS)
+    for name, value in list(element.attrib.items()):
+        if name.startswith("{"):
+            del element.attrib[name]
+            if name != XLINK_HREF:
+                continue
+            name = "href"
+        if name == "id":
+            value = prefix + value
+        elif name == "href" and value.startswith("#"):
+            value = "#" + prefix + value[1:]
+        element.set(name, value.replace("url(#", "url(#" + prefix))
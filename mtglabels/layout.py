@@ -0,0 +1,166 @@
+import argparse
+from dataclasses import dataclass, replace
+
+import mtglabels.config as config
+
+
+@dataclass(frozen=True)
+class SheetSpec:
+    """
+    Declarative description of a label sheet.
+
+    Labels fill the sheet column by column, top to bottom. All lengths are in
+    1/10 mm, like the page size in config.
+    """
+
+    name: str
+    rows: int
+    cols: int
+    width: int = config.LETTER_WIDTH
+    height: int = config.LETTER_HEIGHT
+    margin: int = 40
+    # Extra horizontal / vertical space between labels on top of an even split
+    # of the printable area
+    spacing_x: float = 10
+    spacing_y: float = -18
+    # Gap between neighbouring labels, left out of the label outlines; Avery
+    # 5160 style sheets have 1/8" between columns and none between rows
+    gutter_x: float = 32
+    gutter_y: float = 0
+
+    @property
+    def labels_per_sheet(self):
+        return self.rows * self.cols
+
+    @property
+    def pitch_x(self):
+        return (self.width - 2 * self.margin) / self.cols + self.spacing_x
+
+    @property
+    def pitch_y(self):
+        return (self.height - 2 * self.margin) / self.rows + self.spacing_y
+
+    def positions(self, count, offset_y=0, start=0):
+        """
+        Compute the positions of a run of labels directly from their index.
+
+        Args:
+            count (int): Number of labels.
+            offset_y (int): Vertical offset of the first row below the margin.
+            start (int): Index of the first label.
+
+        Returns:
+            list: (x, y) tuples, one per label.
+        """
+        per_sheet = self.labels_per_sheet
+        origin_y = self.margin + offset_y
+        return [
+            (
+                self.margin + (index % per_sheet) // self.rows * self.pitch_x,
+                origin_y + (index % per_sheet) % self.rows * self.pitch_y,
+            )
+            for index in range(start, start + count)
+        ]
+
+    def place(self, labels, offset_y=0, start=0):
+        """
+        Set the ``x`` / ``y`` coordinates of every label in one call.
+
+        Args:
+            labels (list): List of label data dictionaries.
+            offset_y (int): Vertical offset of the first row below the margin.
+            start (int): Index of the first label.
+
+        Returns:
+            list: The same labels.
+        """
+        positions = self.positions(len(labels), offset_y, start)
+        for label, (x, y) in zip(labels, positions):
+            label["x"] = x
+            label["y"] = y
+        return labels
+
+    def pages(self, labels, offset_y=0):
+        """
+        Split a stream of labels into placed pages, yielding every page as
+        soon as it is full so it can be rendered while later labels are
+        still being produced.
+
+        Args:
+            labels (iterable): Label data dictionaries.
+            offset_y (int): Vertical offset of the first row below the margin.
+
+        Yields:
+            list: The labels of a page, with their coordinates set.
+        """
+        page = []
+        for label in labels:
+            page.append(label)
+            if len(page) == self.labels_per_sheet:
+                yield self.place(page, offset_y)
+                page = []
+        if page:
+            yield self.place(page, offset_y)
+
+
+# Named sheet geometries; letter-30 fits Avery 5160 and 8460 address labels
+# with the default vertical offsets of the generators
+SHEETS = {
+    spec.name: spec
+    for spec in (
+        SheetSpec("letter-30", rows=10, cols=3),
+        SheetSpec("letter-24", rows=8, cols=3),
+        SheetSpec("a4-24", rows=8, cols=3, width=2100, height=2970),
+        SheetSpec("a4-21", rows=7, cols=3, width=2100, height=2970),
+    )
+}
+
+
+def sheet_for(labels_per_sheet):
+    """
+    Get the US Letter sheet with the given number of labels.
+    """
+    return SHEETS[f"letter-{labels_per_sheet}"]
+
+
+def parse_sheet(value):
+    """
+    Parse a ``--sheet`` argument.
+
+    Either the name of a sheet in SHEETS, or a custom geometry given as
+    comma-separated ``key=value`` pairs overriding letter-30, e.g.
+    ``rows=8,cols=3,width=2100,height=2970,margin=50``.
+
+    Returns:
+        SheetSpec: The sheet geometry.
+    """
+    if value in SHEETS:
+        return SHEETS[value]
+
+    fields = {"rows": int, "cols": int, "width": int, "height": int, "margin": int}
+    fields.update(spacing_x=float, spacing_y=float, gutter_x=float, gutter_y=float)
+    try:
+        overrides = {
+            key: fields[key](number)
+            for key, number in (item.split("=", 1) for item in value.split(","))
+        }
+    except (KeyError, ValueError):
+        raise ValueError(
+            f"Unknown sheet {value!r}; use one of {', '.join(SHEETS)} "
+            f"or key=value pairs of {', '.join(fields)}"
+        )
+    spec = replace(SHEETS["letter-30"], name="custom", **overrides)
+    if spec.rows < 1 or spec.cols < 1:
+        raise ValueError("A sheet needs at least one row and one column")
+    return spec
+
+
+def sheet_argument(value):
+    """
+    Parse a ``--sheet`` argument with parse_sheet(), reporting why it is
+    invalid; argparse hides the message of a ValueError.
+    """
+    try:
+        return parse_sheet(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
@@ -0,0 +1,155 @@
+import cProfile
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+# Stages of a run, in pipeline order
+STAGES = ("catalog", "icons", "layout", "render", "combine")
+
+
+def peak_memory():
+    """
+    Get the peak resident memory of this process and of its finished children
+    (the render workers).
+
+    Returns:
+        dict: Peak memory in bytes, or None where the platform does not report it.
+    """
+    if resource is None:
+        return {"self": None, "children": None}
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+class Profiler:
+    """
+    Collects per-stage wall time, per-page render times and counters of a run
+    and writes them as a JSON report.
+    """
+
+    def __init__(self, cprofile_stage=None):
+        """
+        Initialize the Profiler.
+
+        Args:
+            cprofile_stage (str): Run this stage under cProfile, one of STAGES.
+        """
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.running = []
+        self.pages = []
+        self.counters = {}
+        self.cprofile_stage = cprofile_stage
+        self.cprofile = cProfile.Profile() if cprofile_stage else None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the run. A stage that runs more than once accumulates.
+
+        Stages may nest: ``seconds`` is the wall time of the stage including
+        nested stages, ``self_seconds`` excludes them.
+        """
+        cprofile = self.cprofile if name == self.cprofile_stage else None
+        if cprofile:
+            cprofile.enable()
+        # [seconds spent in nested stages]
+        nested = [0.0]
+        self.running.append(nested)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if cprofile:
+                cprofile.disable()
+            self.running.pop()
+            if self.running:
+                self.running[-1][0] += elapsed
+
+            stage = self.stages.setdefault(
+                name, {"seconds": 0.0, "self_seconds": 0.0, "calls": 0}
+            )
+            stage["seconds"] += elapsed
+            stage["self_seconds"] += elapsed - nested[0]
+            stage["calls"] += 1
+
+    def iterate(self, name, iterable):
+        """
+        Iterate lazily, timing the production of every item as stage ``name``.
+
+        This attributes the work of a generator to its own stage while the
+        consumer's work between items is timed by the consumer's stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def page(self, page, seconds):
+        """
+        Record the time it took to render a page.
+        """
+        self.pages.append({"page": page, "seconds": seconds})
+
+    def record(self, name, value):
+        """
+        Record a counter, e.g. the cache statistics of a run.
+        """
+        self.counters[name] = value
+
+    def report(self):
+        """
+        Build the report of the run.
+
+        Returns:
+            dict: The report.
+        """
+        return {
+            "command": sys.argv,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "total_seconds": time.perf_counter() - self.start,
+            "stages": self.stages,
+            "pages": sorted(self.pages, key=lambda page: page["page"]),
+            "counters": self.counters,
+            "peak_memory_bytes": peak_memory(),
+        }
+
+    def write(self, path):
+        """
+        Write the report to ``path``, and the cProfile statistics of the
+        profiled stage next to it with a ``.pstats`` suffix.
+
+        Args:
+            path (Path): Where to write the JSON report.
+        """
+        path = Path(path)
+        with path.open("w") as fd:
+            json.dump(self.report(), fd, indent=2)
+        log.info(f"Writing {path}...")
+
+        if self.cprofile:
+            pstats_path = path.with_suffix(".pstats")
+            self.cprofile.dump_stats(pstats_path)
+            log.info(f"Writing {pstats_path}...")
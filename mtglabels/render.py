@@ -0,0 +1,920 @@
+import collections
+import hashlib
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import jinja2
+import PyPDF2
+from cairosvg.parser import Tree
+from cairosvg.surface import PDFSurface, PNGSurface, cairo
+
+import mtglabels.config as config
+from mtglabels.catalog import write_atomic
+from mtglabels.profiling import Profiler
+
+log = logging.getLogger(__name__)
+
+# Content hashes of the pages of an incremental run, kept in the output directory
+MANIFEST_FILENAME = "manifest.json"
+
+# Get the base directory of the script
+BASE_DIR = Path(__file__).resolve().parent
+
+# Set up the Jinja2 environment for template loading
+ENV = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(BASE_DIR / "templates"),
+    autoescape=jinja2.select_autoescape(["html", "xml"]),
+)
+
+
+def get_template(name):
+    """
+    Load a label template through the bytecode cache.
+
+    Compiled templates are cached across processes in ``templates`` under
+    config.CACHE_DIR; an entry is recompiled when the checksum of its template
+    source changes. The cache is set up on the first load, so importing this
+    module does not touch the cache directory.
+
+    Args:
+        name (str): The template name.
+
+    Returns:
+        jinja2.Template: The template.
+    """
+    if ENV.bytecode_cache is None:
+        cache_dir = Path(config.CACHE_DIR) / "templates"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        ENV.bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+    return ENV.get_template(name)
+
+
+def precompile_templates():
+    """
+    Compile every label template into the bytecode cache. Icons stored under
+    ``templates/svg`` are not templates and are skipped.
+
+    Returns:
+        list: The names of the compiled templates.
+    """
+    names = ENV.list_templates(filter_func=lambda name: "/" not in name)
+    for name in names:
+        get_template(name)
+    return names
+
+
+@lru_cache
+def sheet_outline(sheet, offset_y=0):
+    """
+    Build the outline layer drawing the rounded rectangle of every label of a
+    sheet.
+
+    Every rectangle is drawn where SheetSpec.positions() places the label,
+    spanning the label pitch less the gutter between labels. It is computed
+    once per sheet geometry and drawn once per page, underneath the labels.
+
+    Args:
+        sheet (SheetSpec): The sheet geometry.
+        offset_y (int): Vertical offset of the labels below the margin.
+
+    Returns:
+        str: The ``<g>`` element holding the outline rectangles.
+    """
+    width = sheet.pitch_x - sheet.gutter_x
+    height = sheet.pitch_y - sheet.gutter_y
+    # 2.5 mm corner radius, as on Avery address labels
+    radius = 25
+
+    rects = [
+        f'<rect x="{x:g}" y="{y:g}" width="{width:g}" height="{height:g}" '
+        f'rx="{radius}" ry="{radius}"/>'
+        for x, y in sheet.positions(sheet.labels_per_sheet, offset_y)
+    ]
+    return (
+        '<g fill="none" stroke="#404040" stroke-miterlimit="10">'
+        + "".join(rects)
+        + "</g>"
+    )
+
+
+def render_svg(template_name, context, outfile_svg, keep_svg):
+    """
+    Render the label template of a single page, writing it to disk if requested.
+
+    Returns:
+        str: The rendered SVG.
+    """
+    output = get_template(template_name).render(**context)
+
+    if keep_svg:
+        log.info(f"Writing {outfile_svg}...")
+        with outfile_svg.open("w") as fd:
+            fd.write(output)
+
+    return output
+
+
+def render_page(
+    template_name,
+    context,
+    outfile_svg,
+    outfile_pdf,
+    keep_svg,
+    keep_pages,
+    outfile_png=None,
+    dpi=None,
+):
+    """
+    Render a single page of labels and convert it to PDF in memory.
+
+    The rendered SVG is handed to cairosvg as bytes; ``outfile_svg`` only
+    serves as the base URL for relative icon references. The SVG and the page
+    PDF are written to disk only when requested. With ``outfile_png``, the
+    page is also rasterized from the same parsed SVG, so it is not parsed a
+    second time for its preview.
+
+    This runs in the worker processes of PageRenderer, so it must stay a
+    module-level function taking picklable arguments.
+
+    Args:
+        template_name (str): The name of the label template.
+        context (dict): The template context, including the page's labels.
+        outfile_svg (Path): Path of the page SVG.
+        outfile_pdf (Path): Path of the page PDF.
+        keep_svg (bool): Write the rendered SVG to ``outfile_svg``.
+        keep_pages (bool): Write the page PDF to ``outfile_pdf``.
+        outfile_png (Path): Also write a PNG of the page to this path.
+        dpi (int): The resolution of the PNG. Defaults to config.PNG_DPI.
+
+    Returns:
+        bytes: The page PDF.
+    """
+    output = render_svg(template_name, context, outfile_svg, keep_svg)
+
+    tree = Tree(bytestring=output.encode(), url=str(outfile_svg), unsafe=True)
+    pdf = surface_bytes(PDFSurface, tree)
+    if outfile_png is not None:
+        write_png(tree, outfile_png, dpi)
+
+    if keep_pages:
+        log.info(f"Writing {outfile_pdf}...")
+        with outfile_pdf.open("wb") as fd:
+            fd.write(pdf)
+
+    return pdf
+
+
+def rasterize_page(template_name, context, outfile_svg, outfile_png, dpi, keep_svg):
+    """
+    Render a single page of labels and convert it to PNG.
+
+    This runs in the worker processes of PageRenderer, so it must stay a
+    module-level function taking picklable arguments.
+
+    Args:
+        template_name (str): The name of the label template.
+        context (dict): The template context, including the page's labels.
+        outfile_svg (Path): Path of the page SVG.
+        outfile_png (Path): Path of the PNG.
+        dpi (int): The resolution of the PNG. Defaults to config.PNG_DPI.
+        keep_svg (bool): Write the rendered SVG to ``outfile_svg``.
+    """
+    output = render_svg(template_name, context, outfile_svg, keep_svg)
+    tree = Tree(bytestring=output.encode(), url=str(outfile_svg), unsafe=True)
+    write_png(tree, outfile_png, dpi)
+
+
+def surface_bytes(surface_class, tree, dpi=96):
+    """
+    Draw a parsed SVG onto a cairosvg surface in memory.
+
+    Returns:
+        bytes: The surface output, e.g. a PDF or PNG.
+    """
+    output = io.BytesIO()
+    surface_class(tree, output, dpi).finish()
+    return output.getvalue()
+
+
+def write_png(tree, path, dpi=None):
+    """
+    Rasterize a parsed SVG to a PNG file.
+
+    Workers may rasterize identical pages into the same raster cache entry at
+    once, so every process writes through a temporary file of its own.
+    """
+    png = surface_bytes(PNGSurface, tree, dpi or config.PNG_DPI)
+    part_path = path.with_name(f"{path.name}.{os.getpid()}.part")
+    with part_path.open("wb") as fd:
+        fd.write(png)
+    part_path.replace(path)
+
+
+def pool_context():
+    """
+    Get the multiprocessing context of the render workers.
+
+    Workers are started while icon downloads are still running in threads,
+    and forking a process with running threads can deadlock the child. Where
+    available, workers are forked from a clean forkserver process that has
+    the render module preloaded; elsewhere the platform default is used.
+
+    Returns:
+        multiprocessing.context.BaseContext: The context, or None for the default.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def timed_render_page(*args):
+    """
+    Render a page with render_page(), measuring how long it takes.
+
+    Returns:
+        tuple: (the page PDF as bytes, seconds it took to render)
+    """
+    start = time.perf_counter()
+    pdf = render_page(*args)
+    return pdf, time.perf_counter() - start
+
+
+def timed_rasterize_page(*args):
+    """
+    Rasterize a page with rasterize_page(), measuring how long it takes.
+
+    Returns:
+        float: Seconds it took to render the page.
+    """
+    start = time.perf_counter()
+    rasterize_page(*args)
+    return time.perf_counter() - start
+
+
+def draw_page(document, template_name, context, outfile_svg, keep_svg):
+    """
+    Render a single page of labels and draw it as the next page of a
+    multi-page cairo PDF surface.
+    """
+    output = render_svg(template_name, context, outfile_svg, keep_svg)
+    tree = Tree(bytestring=output.encode(), url=str(outfile_svg), unsafe=True)
+    DocumentPageSurface(tree, document)
+    document.show_page()
+
+
+def render_document_pdf(template_name, contexts, outfiles_svg, keep_svg):
+    """
+    Render several pages of labels into a single multi-page PDF in memory, so
+    the fonts they use are embedded once.
+
+    This runs in the worker processes of PageRenderer, so it must stay a
+    module-level function taking picklable arguments.
+
+    Args:
+        template_name (str): The name of the label template.
+        contexts (list): The template context of every page.
+        outfiles_svg (list): Path of the SVG of every page.
+        keep_svg (bool): Write the rendered SVG of every page.
+
+    Returns:
+        tuple: (the PDF as bytes, list of seconds it took to render every page)
+    """
+    output = io.BytesIO()
+    # The initial size is replaced by the size of every page as it is drawn
+    document = cairo.PDFSurface(output, 1, 1)
+    seconds = []
+    for context, outfile_svg in zip(contexts, outfiles_svg):
+        start = time.perf_counter()
+        draw_page(document, template_name, context, outfile_svg, keep_svg)
+        seconds.append(time.perf_counter() - start)
+    document.finish()
+    return output.getvalue(), seconds
+
+
+class DocumentPageSurface(PDFSurface):
+    """
+    cairosvg PDF surface drawing onto the current page of a shared multi-page
+    cairo PDF document instead of creating a document of its own.
+    """
+
+    def __init__(self, tree, document, dpi=96):
+        self.document = document
+        super().__init__(tree, None, dpi)
+
+    def _create_surface(self, width, height):
+        self.document.set_size(width, height)
+        return self.document, width, height
+
+
+class RasterCache:
+    """
+    PNGs of rendered pages, keyed by the content hash of the page and the
+    resolution, so unchanged pages are not rasterized again on later runs.
+
+    Entries are touched when they are used, and the least recently used
+    entries are evicted once the cache grows beyond its size cap.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        """
+        Initialize the RasterCache.
+
+        Args:
+            cache_dir (Path): The cache directory. Defaults to ``raster`` in config.CACHE_DIR.
+            max_bytes (int): The size cap of the cache. Defaults to config.RASTER_CACHE_MAX_BYTES.
+        """
+        self.cache_dir = Path(cache_dir or Path(config.CACHE_DIR) / "raster")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes or config.RASTER_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, page_digest, dpi):
+        return self.cache_dir / f"{page_digest}-{dpi}.png"
+
+    def lookup(self, path):
+        """
+        Check whether a page is cached, marking it as recently used.
+
+        Args:
+            path (Path): The entry of the page, see path_for().
+
+        Returns:
+            bool: True if the PNG is cached.
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def counters(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def prune(self):
+        """
+        Evict the least recently used entries beyond the size cap.
+        """
+        entries = []
+        for path in self.cache_dir.glob("*.png"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        evicted = 0
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+            evicted += 1
+        if evicted:
+            log.info(
+                f"Evicted {evicted} pages from the raster cache "
+                f"({format_size(size)} left)"
+            )
+
+
+class PageRenderer:
+    """
+    Renders batches of labels into pages, optionally in a process pool.
+    """
+
+    def __init__(
+        self,
+        template_name,
+        output_dir,
+        prefix,
+        jobs=1,
+        keep_svg=False,
+        keep_pages=False,
+        icon_library=None,
+        profiler=None,
+        executor=None,
+        raster_cache=None,
+        dpi=None,
+    ):
+        """
+        Initialize the PageRenderer.
+
+        Args:
+            template_name (str): The name of the label template.
+            output_dir (Path): The output directory for the rendered pages.
+            prefix (str): The file name prefix of the pages, e.g. ``labels-30``.
+            jobs (int): Number of worker processes. 1 renders in the current process.
+            keep_svg (bool): Write the rendered SVG of every page.
+            keep_pages (bool): Write the PDF of every page.
+            icon_library (IconLibrary): Library of the icons inlined into the pages.
+            profiler (Profiler): Records the render time of every page.
+            executor (ProcessPoolExecutor): A running worker pool to render in,
+                e.g. one shared by the jobs of a batch, instead of a pool of ``jobs``
+                workers started for every render.
+            raster_cache (RasterCache): Also write a PNG of every page, through this cache.
+            dpi (int): The resolution of the PNGs. Defaults to config.PNG_DPI.
+        """
+        self.template_name = template_name
+        self.output_dir = Path(output_dir)
+        self.prefix = prefix
+        self.jobs = jobs
+        self.keep_svg = keep_svg
+        self.keep_pages = keep_pages
+        self.icon_library = icon_library
+        self.profiler = profiler or Profiler()
+        self.executor = executor
+        self.raster_cache = raster_cache
+        self.dpi = dpi or config.PNG_DPI
+
+    def page_paths(self, page):
+        stem = self.output_dir / f"{self.prefix}-{page:02}"
+        return stem.with_suffix(".svg"), stem.with_suffix(".pdf")
+
+    def png_path(self, page):
+        return self.output_dir / f"{self.prefix}-{page:02}.png"
+
+    def page_context(self, batch, context):
+        """
+        Get the template context of a single page.
+
+        Besides the page's labels, this holds the ``<symbol>`` definitions of
+        the icons used on the page, so each icon is inlined once per page.
+        """
+        icon_defs = self.icon_library.defs(batch) if self.icon_library else []
+        return {**(context or {}), "labels": batch, "icon_defs": icon_defs}
+
+    def iter_render(self, batches, context=None, page_numbers=None):
+        """
+        Render every batch of labels into its own page, yielding the page PDFs
+        in page order as they are done.
+
+        With a raster cache, a PNG of every page is written as well, taken
+        from the cache or rasterized along with the page PDF.
+
+        Args:
+            batches (iterable): Lists of label data dictionaries, one per page.
+            context (dict): Extra template context shared by all pages.
+            page_numbers (iterable): Page number of every batch. Defaults to 1, 2, ...
+
+        Yields:
+            bytes: The page PDFs, in page order.
+        """
+        if page_numbers is None:
+            page_numbers = itertools.count(1)
+
+        def tasks():
+            # Pages are built lazily, so each page starts rendering as soon as
+            # its batch of labels is available
+            for page, batch in zip(page_numbers, batches):
+                page_context = self.page_context(batch, context)
+                cached_png = outfile_png = None
+                if self.raster_cache is not None:
+                    cached_png = self.cached_png(page_context)
+                    if not self.raster_cache.lookup(cached_png):
+                        outfile_png = cached_png
+                yield (page, cached_png), (
+                    self.template_name,
+                    page_context,
+                    *self.page_paths(page),
+                    self.keep_svg,
+                    self.keep_pages,
+                    outfile_png,
+                    self.dpi,
+                )
+
+        for (page, cached_png), (pdf, seconds) in self.map_pages(
+            timed_render_page, tasks()
+        ):
+            self.profiler.page(page, seconds)
+            if cached_png is not None:
+                self.write_png(page, cached_png)
+            yield pdf
+
+        if self.raster_cache is not None:
+            self.raster_cache.prune()
+
+    def render_png(self, batches, context=None, page_numbers=None):
+        """
+        Rasterize every batch of labels into a PNG of its own, without
+        rendering any PDF.
+
+        Pages found in the raster cache are copied from it; the others are
+        rasterized, in the worker pool when there is more than one job.
+
+        Args:
+            batches (iterable): Lists of label data dictionaries, one per page.
+            context (dict): Extra template context shared by all pages.
+            page_numbers (iterable): Page number of every batch. Defaults to 1, 2, ...
+        """
+        if page_numbers is None:
+            page_numbers = itertools.count(1)
+
+        def tasks():
+            for page, batch in zip(page_numbers, batches):
+                page_context = self.page_context(batch, context)
+                cached_png = self.cached_png(page_context)
+                if self.raster_cache.lookup(cached_png):
+                    self.write_png(page, cached_png)
+                    continue
+                yield (page, cached_png), (
+                    self.template_name,
+                    page_context,
+                    self.page_paths(page)[0],
+                    cached_png,
+                    self.dpi,
+                    self.keep_svg,
+                )
+
+        for (page, cached_png), seconds in self.map_pages(
+            timed_rasterize_page, tasks()
+        ):
+            self.profiler.page(page, seconds)
+            self.write_png(page, cached_png)
+
+        log.info(
+            f"{self.raster_cache.hits} page PNGs from the raster cache, "
+            f"{self.raster_cache.misses} rasterized"
+        )
+        self.raster_cache.prune()
+
+    def cached_png(self, page_context):
+        """
+        Get the raster cache entry of a page at the resolution of the renderer.
+        """
+        return self.raster_cache.path_for(self.page_digest(page_context), self.dpi)
+
+    def write_png(self, page, cached_png):
+        """
+        Copy the cached PNG of a page to the output directory.
+        """
+        path = self.png_path(page)
+        log.info(f"Writing {path}...")
+        shutil.copyfile(cached_png, path)
+
+    def map_pages(self, function, tasks):
+        """
+        Run ``function`` on the arguments of every task, in the worker pool
+        when there is more than one job.
+
+        At most two tasks per worker are in flight, so neither pending tasks
+        nor finished results pile up in memory when the consumer is slower
+        than the workers.
+
+        Args:
+            function (callable): A module-level function, so it can be pickled.
+            tasks (iterable): (key, arguments) tuples.
+
+        Yields:
+            tuple: (key, result), in task order.
+        """
+        if self.executor is None and self.jobs <= 1:
+            for key, args in tasks:
+                yield key, function(*args)
+            return
+
+        # Compile the template before any page is submitted, so workers find
+        # it in the bytecode cache
+        get_template(self.template_name)
+
+        if self.executor is not None:
+            yield from self.map_in_pool(self.executor, function, tasks)
+            return
+        with ProcessPoolExecutor(self.jobs, mp_context=pool_context()) as executor:
+            yield from self.map_in_pool(executor, function, tasks)
+
+    def map_in_pool(self, executor, function, tasks):
+        """
+        Submit the tasks to a running worker pool, see map_pages().
+        """
+        in_flight = collections.deque()
+        for key, args in tasks:
+            in_flight.append((key, executor.submit(function, *args)))
+            if len(in_flight) >= 2 * self.jobs:
+                # Collect the results in submission order, keeping pages stable
+                key, future = in_flight.popleft()
+                yield key, future.result()
+        while in_flight:
+            key, future = in_flight.popleft()
+            yield key, future.result()
+
+    def render(self, batches, context=None, page_numbers=None):
+        """
+        Render every batch of labels into its own page.
+
+        Args:
+            batches (iterable): Lists of label data dictionaries, one per page.
+            context (dict): Extra template context shared by all pages.
+            page_numbers (iterable): Page number of every batch. Defaults to 1, 2, ...
+
+        Returns:
+            list: The page PDFs as bytes, in page order.
+        """
+        return list(self.iter_render(batches, context, page_numbers))
+
+    def page_digest(self, page_context):
+        """
+        Hash everything a page is rendered from: the template source, the
+        template context (labels, inlined icons, page size) and the contents
+        of any raster icons referenced by path.
+
+        Returns:
+            str: The hex digest of the page.
+        """
+        digest = hashlib.sha256()
+        source, _, _ = ENV.loader.get_source(ENV, self.template_name)
+        digest.update(source.encode())
+        digest.update(json.dumps(page_context, sort_keys=True, default=str).encode())
+        for label in page_context["labels"]:
+            for icon_path in label.get("icon_paths", ()):
+                digest.update(Path(icon_path).read_bytes())
+        return digest.hexdigest()
+
+    def render_incremental(self, batches, context, outfile_pdf, split_pages=None):
+        """
+        Render only the pages whose contents changed since the last run.
+
+        Page PDFs are kept in the output directory next to a manifest of the
+        content hash of every page. Pages whose hash matches the manifest and
+        whose PDF still exists are reused as they are; the combined PDF is
+        rebuilt only when a page changed, or pages were added or removed.
+        With a raster cache, the PNGs of the reused pages are taken from it.
+
+        Args:
+            batches (iterable): Lists of label data dictionaries, one per page.
+            context (dict): Extra template context shared by all pages.
+            outfile_pdf (Path): Where to write the combined PDF.
+            split_pages (int): Split the combined PDF into files of at most this many pages.
+        """
+        manifest_path = self.output_dir / MANIFEST_FILENAME
+        try:
+            manifest = json.loads(manifest_path.read_text())
+        except (OSError, ValueError):
+            manifest = {}
+        previous = manifest.get("pages", {})
+
+        contexts = [self.page_context(batch, context) for batch in batches]
+        digests = {}
+        stale = []
+        for page, page_context in enumerate(contexts, start=1):
+            _, page_pdf = self.page_paths(page)
+            digest = digests[page_pdf.name] = self.page_digest(page_context)
+            if previous.get(page_pdf.name) != digest or not page_pdf.exists():
+                stale.append(page)
+
+        log.info(f"{len(stale)} of {len(contexts)} pages changed")
+
+        # Page PDFs are the cache of an incremental run, so they are always kept
+        keep_pages = self.keep_pages
+        self.keep_pages = True
+        try:
+            # The page PDFs are on disk, so they are not collected in memory
+            for _ in self.iter_render(
+                [contexts[page - 1]["labels"] for page in stale], context, stale
+            ):
+                pass
+        finally:
+            self.keep_pages = keep_pages
+
+        if self.raster_cache is not None:
+            fresh = sorted(set(range(1, len(contexts) + 1)) - set(stale))
+            self.render_png(
+                [contexts[page - 1]["labels"] for page in fresh], context, fresh
+            )
+
+        # Drop pages left over from a longer previous run
+        for name in set(previous) - set(digests):
+            (self.output_dir / name).unlink(missing_ok=True)
+
+        combined = hashlib.sha256(
+            ("".join(digests.values()) + str(split_pages)).encode()
+        ).hexdigest()
+        outputs = manifest.get("outputs", [outfile_pdf.name])
+        if manifest.get("combined") != combined or not all(
+            (self.output_dir / name).exists() for name in outputs
+        ):
+            written = combine_pdfs(
+                self.output_dir,
+                ((self.output_dir / name).read_bytes() for name in digests),
+                split_pages,
+            )
+            # Drop combined files left over from a run split differently
+            for name in set(outputs) - {path.name for path in written}:
+                (self.output_dir / name).unlink(missing_ok=True)
+            outputs = [path.name for path in written]
+        else:
+            log.info(f"{', '.join(outputs)} up to date")
+
+        manifest = {"pages": digests, "combined": combined, "outputs": outputs}
+        write_atomic(manifest_path, json.dumps(manifest, indent=2).encode())
+
+    def render_document(self, batches, context, outfile_pdf, split_pages=None):
+        """
+        Render every batch of labels as a page of a single PDF, in one pass.
+
+        Pages are drawn one after the other onto the same cairo PDF surface, so
+        there are no page PDFs to parse and merge and fonts are embedded once
+        for the whole document. With more than one job, see render_chunks().
+        With a raster cache, the PNGs are written afterwards by render_png().
+
+        Args:
+            batches (iterable): Lists of label data dictionaries, one per page.
+            context (dict): Extra template context shared by all pages.
+            outfile_pdf (Path): Where to write the PDF.
+            split_pages (int): Start a new PDF every this many pages, named
+                like ``outfile_pdf`` with a part number.
+        """
+        if self.keep_pages:
+            log.warning("Page PDFs are not written by the single-pass renderer")
+        if self.raster_cache is not None:
+            # Pages are drawn onto a shared PDF surface, so their PNGs are
+            # rasterized in a second pass
+            batches = list(batches)
+            raster_cache, self.raster_cache = self.raster_cache, None
+            try:
+                self.render_document(batches, context, outfile_pdf, split_pages)
+            finally:
+                self.raster_cache = raster_cache
+            self.render_png(batches, context)
+            return
+        if self.jobs > 1:
+            return self.render_chunks(batches, context, outfile_pdf, split_pages)
+
+        document = None
+        for page, batch in enumerate(batches, start=1):
+            if document is None:
+                path = (
+                    part_path(outfile_pdf, (page - 1) // split_pages + 1)
+                    if split_pages
+                    else outfile_pdf
+                )
+                # The initial size is replaced by the size of every page as it
+                # is drawn
+                document = cairo.PDFSurface(str(path), 1, 1)
+            start = time.perf_counter()
+            outfile_svg, _ = self.page_paths(page)
+            draw_page(
+                document,
+                self.template_name,
+                self.page_context(batch, context),
+                outfile_svg,
+                self.keep_svg,
+            )
+            self.profiler.page(page, time.perf_counter() - start)
+
+            if split_pages and page % split_pages == 0:
+                document.finish()
+                log.info(f"Writing {path} ({format_size(path.stat().st_size)})...")
+                document = None
+
+        if document is not None:
+            document.finish()
+            log.info(f"Writing {path} ({format_size(path.stat().st_size)})...")
+
+    def render_chunks(self, batches, context, outfile_pdf, split_pages=None):
+        """
+        Render runs of consecutive pages in the worker pool, each run drawn
+        onto a multi-page PDF of its own, and combine the runs.
+
+        Fonts are embedded once per run rather than once per page as with
+        the merge renderer, which keeps most of the size benefit of a single
+        pass while pages render in parallel.
+
+        Args:
+            batches (iterable): Lists of label data dictionaries, one per page.
+            context (dict): Extra template context shared by all pages.
+            outfile_pdf (Path): Where to write the PDF.
+            split_pages (int): Write every run of this many pages as a part of
+                its own, named like ``outfile_pdf`` with a part number.
+        """
+        chunk_pages = split_pages or config.DOCUMENT_CHUNK_PAGES
+        numbered = enumerate(batches, start=1)
+        chunks = iter(lambda: list(itertools.islice(numbered, chunk_pages)), [])
+        tasks = (
+            (
+                [page for page, _ in chunk],
+                (
+                    self.template_name,
+                    [self.page_context(batch, context) for _, batch in chunk],
+                    [self.page_paths(page)[0] for page, _ in chunk],
+                    self.keep_svg,
+                ),
+            )
+            for chunk in chunks
+        )
+
+        def documents():
+            for pages, (pdf, seconds) in self.map_pages(render_document_pdf, tasks):
+                for page, page_seconds in zip(pages, seconds):
+                    self.profiler.page(page, page_seconds)
+                yield pdf
+
+        if not split_pages:
+            combine_pdfs(outfile_pdf.parent, documents())
+            return
+
+        for part, pdf in enumerate(documents(), start=1):
+            path = part_path(outfile_pdf, part)
+            with path.open("wb") as fd:
+                fd.write(pdf)
+            log.info(f"Writing {path} ({format_size(len(pdf))})...")
+
+
+def format_size(size):
+    """
+    Format a size in bytes for the log, e.g. ``1.4 MiB``.
+    """
+    if size < 1024:
+        return f"{size} bytes"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KiB"
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+def part_path(path, part):
+    """
+    Get the path of a part of a split PDF, e.g. ``combined_labels-002.pdf``.
+    """
+    return path.with_name(f"{path.stem}-{part:03}{path.suffix}")
+
+
+def combine_pdfs(output_dir, pages, split_pages=None):
+    """
+    Combine the page PDFs into a single ``combined_labels.pdf``.
+
+    Pages are consumed one at a time, so they can be produced lazily while
+    earlier pages are merged. PyPDF2 cannot append to a written PDF, so
+    without ``split_pages`` the merger holds every page until the combined PDF
+    is written at the end, and memory grows with the number of pages.
+
+    With ``split_pages``, the pages are combined into
+    ``combined_labels-001.pdf``, ``combined_labels-002.pdf``, ... of at most
+    that many pages each; every part is written and released before the next
+    one starts, which bounds memory by the size of a part.
+
+    Args:
+        output_dir (Path): The output directory.
+        pages (iterable): The page PDFs as bytes, in page order.
+        split_pages (int): Maximum number of pages per combined file.
+
+    Returns:
+        list: The paths of the written PDFs.
+    """
+    combined_pdf_path = output_dir / "combined_labels.pdf"
+    written = []
+
+    def write(pdf_merger, input_size):
+        path = (
+            part_path(combined_pdf_path, len(written) + 1)
+            if split_pages
+            else combined_pdf_path
+        )
+        with path.open("wb") as combined_pdf:
+            pdf_merger.write(combined_pdf)
+        pdf_merger.close()
+        log.info(
+            f"Writing {path} ({format_size(path.stat().st_size)}, merged from "
+            f"{format_size(input_size)})..."
+        )
+        written.append(path)
+
+    pdf_merger = PyPDF2.PdfMerger()
+    count = input_size = 0
+    for page in pages:
+        pdf_merger.append(io.BytesIO(page))
+        count += 1
+        input_size += len(page)
+        if split_pages and count == split_pages:
+            write(pdf_merger, input_size)
+            pdf_merger = PyPDF2.PdfMerger()
+            count = input_size = 0
+
+    # Output combined PDF, or the last part of a split one
+    if count or not written:
+        write(pdf_merger, input_size)
+    return written
+
+
+def clean_up_pdfs(output_dir, pattern="labels-*.pdf"):
+    # List all PDF files in the output directory that match the specified pattern
+    pdf_files = sorted(output_dir.glob(pattern))
+
+    for pdf_file in pdf_files:
+        try:
+            pdf_file.unlink()
+            log.info(f"Deleted {pdf_file}")
+        except Exception as e:
+            log.error(f"Error deleting {pdf_file}: {e}")
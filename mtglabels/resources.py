@@ -0,0 +1,91 @@
+import logging
+from pathlib import Path
+
+import mtglabels.config as config
+
+log = logging.getLogger(__name__)
+
+
+class Resources:
+    """
+    The Scryfall session, catalog and icon caches, set database, icon library
+    and render worker pool used by a label generator.
+
+    A single generator builds its own; a batch run builds them once and
+    shares them between the generators of all its jobs, so catalogs are
+    fetched and icons are parsed once per batch.
+    """
+
+    def __init__(self, offline=False, catalog_ttl=None, record=None, replay=None):
+        """
+        Initialize the Resources.
+
+        Args:
+            offline (bool): Only use cached catalogs and icons.
+            catalog_ttl (int): Seconds a cached catalog is used before revalidation. Defaults to config.CATALOG_TTL.
+            record (str): Save every Scryfall response to this directory.
+            replay (str): Serve Scryfall responses from a directory saved with ``record`` instead of the network.
+        """
+        # The catalog and icon stages pull in requests; they are imported only
+        # once the arguments are validated, so --help and argument errors
+        # return without loading them
+        from mtglabels.catalog import CatalogCache
+        from mtglabels.icons import IconCache, IconLibrary
+        from mtglabels.scryfall import get_session
+        from mtglabels.setdb import SetDatabase
+
+        # Recorded and replayed runs keep their caches next to the recording,
+        # so a replay reproduces exactly the recorded catalogs and icons
+        http_dir = record or replay
+        cache_dir = Path(http_dir) / "cache" if http_dir else Path(config.CACHE_DIR)
+        self.session = get_session(record_dir=record, replay_dir=replay)
+        self.catalog = CatalogCache(
+            cache_dir / "catalog",
+            # Always revalidate while recording, so the recording is current
+            ttl=0 if record else catalog_ttl,
+            offline=offline,
+        )
+        self.icon_cache = IconCache(cache_dir / "icons", offline=offline)
+        self.set_db = SetDatabase(cache_dir / "sets.sqlite3")
+        self.icon_library = IconLibrary()
+        # Render worker pool shared by all generators, see start_pool()
+        self.executor = None
+
+    def sync_sets(self):
+        """
+        Sync the set database with the /sets catalog, revalidating the
+        catalog once its TTL expired.
+        """
+        self.set_db.sync(
+            self.catalog.refresh(self.session, config.API_ENDPOINT + "/sets")
+        )
+
+    def start_pool(self, jobs):
+        """
+        Start a render worker pool shared by every generator using these
+        resources, instead of one pool per generator.
+
+        Args:
+            jobs (int): Number of worker processes.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        from mtglabels.render import pool_context
+
+        self.executor = ProcessPoolExecutor(jobs, mp_context=pool_context())
+
+    def close(self):
+        """
+        Shut the shared render worker pool down, if one was started, and
+        close the set database.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.set_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
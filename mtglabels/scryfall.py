@@ -0,0 +1,157 @@
+import hashlib
+import io
+import json
+import logging
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+import mtglabels.config as config
+from mtglabels.catalog import write_atomic
+
+log = logging.getLogger(__name__)
+
+# Response headers kept in a recording
+RECORDED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+def recording_paths(directory, url):
+    """
+    Get the paths of the recorded response to a URL.
+
+    The file name keeps the last path segment readable and appends a digest
+    of the full URL, including Scryfall's ``?<timestamp>`` version stamp.
+
+    Returns:
+        tuple: (metadata path, body path)
+    """
+    name = Path(urlparse(url).path).name or "index"
+    stem = f"{name}-{hashlib.sha1(url.encode()).hexdigest()[:12]}"
+    directory = Path(directory)
+    return directory / f"{stem}.json", directory / f"{stem}.body"
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter that saves every successful response to a directory,
+    to be served later by ReplayAdapter.
+    """
+
+    def __init__(self, directory, **kwargs):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code == 200:
+            meta_path, body_path = recording_paths(self.directory, request.url)
+            # Reading the content here keeps it available to iter_content()
+            write_atomic(body_path, response.content)
+            meta = {
+                "url": request.url,
+                "headers": {
+                    name: response.headers[name]
+                    for name in RECORDED_HEADERS
+                    if name in response.headers
+                },
+            }
+            write_atomic(meta_path, json.dumps(meta, indent=2).encode())
+            log.debug(f"Recorded {request.url}")
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter serving responses saved by RecordingAdapter, without
+    touching the network.
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = Path(directory)
+
+    def send(self, request, **kwargs):
+        meta_path, body_path = recording_paths(self.directory, request.url)
+        try:
+            with meta_path.open() as fd:
+                meta = json.load(fd)
+            body = body_path.read_bytes()
+        except (OSError, ValueError):
+            raise requests.exceptions.ConnectionError(
+                f"{request.url} is not recorded in {self.directory}", request=request
+            )
+
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        response.headers = CaseInsensitiveDict(meta["headers"])
+
+        etag = response.headers.get("ETag")
+        if etag and request.headers.get("If-None-Match") == etag:
+            response.status_code = 304
+            response.reason = "Not Modified"
+            body = b""
+        else:
+            response.status_code = 200
+            response.reason = "OK"
+        response.raw = io.BytesIO(body)
+        # The body is already read, so iter_content() serves it from memory
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_session(record_dir=None, replay_dir=None):
+    """
+    Get the session used for all Scryfall requests, built on first use.
+
+    Args:
+        record_dir (str): Save every response to this directory.
+        replay_dir (str): Serve responses from this directory instead of the network.
+
+    Returns:
+        requests.Session: The session, with the retry strategy mounted.
+    """
+    session = requests.Session()
+
+    if replay_dir:
+        adapter = ReplayAdapter(replay_dir)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    # Retry Strategy for requests
+    retry_strategy = Retry(
+        total=3,  # Total number of retries to allow
+        status_forcelist=[
+            429,
+            500,
+            502,
+            503,
+            504,
+        ],  # Status codes to retry
+        allowed_methods=["HEAD", "GET", "OPTIONS"],  # HTTP methods to retry
+        backoff_factor=1,  # Backoff factor for retries
+    )
+    adapter_options = {
+        "max_retries": retry_strategy,
+        "pool_maxsize": config.DOWNLOAD_WORKERS,
+    }
+    if record_dir:
+        adapter = RecordingAdapter(record_dir, **adapter_options)
+    else:
+        adapter = HTTPAdapter(**adapter_options)
+    # Mount the retry strategy
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,378 @@
+"""
+Long-running HTTP label service.
+
+Keeps the catalogs, parsed icons, compiled templates and a render worker pool
+warm between requests, and caches the most recently generated PDFs::
+
+    mtglabels serve --port 8080 --jobs 4
+    curl -o labels.pdf "http://127.0.0.1:8080/labels.pdf?sets=lea,mh1"
+    curl -o cost.pdf "http://127.0.0.1:8080/labels.pdf?generator=color&type=cost"
+
+Query parameters of ``/labels.pdf``: ``generator`` (sets or color),
+``labels_per_sheet``, ``template`` (one of the TEMPLATES of the generator),
+``sets`` (comma-separated set codes, set labels only), and ``type`` and
+``offset_y`` (color labels only). ``/stats`` reports the result cache
+counters as JSON.
+"""
+
+import argparse
+import json
+import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import mtglabels.config as config
+from mtglabels.batch import load_generator
+from mtglabels.layout import SHEETS, sheet_for
+
+log = logging.getLogger(__name__)
+
+# Label types of the color generator
+LABEL_TYPES = ("all", "tca", "type", "cost", "alpha")
+
+# Templates every generator can render; the others expect different labels
+TEMPLATES = {
+    "sets": ("labels.svg",),
+    "color": ("symbols.svg",),
+}
+
+
+class BadRequest(ValueError):
+    """
+    Raised for a label request with invalid parameters.
+    """
+
+
+class LabelService:
+    """
+    Generates label PDFs on request with warm shared resources, keeping the
+    most recently requested results in an LRU cache.
+    """
+
+    def __init__(self, jobs=1, cache_entries=None, offline=False, catalog_ttl=None):
+        """
+        Initialize the LabelService.
+
+        Args:
+            jobs (int): Number of render worker processes, kept running.
+            cache_entries (int): Number of PDFs kept in the result cache. Defaults to config.SERVE_CACHE_ENTRIES.
+            offline (bool): Only use cached catalogs and icons.
+            catalog_ttl (int): Seconds the catalogs and cached results are used before the catalogs are revalidated.
+        """
+        from mtglabels.render import precompile_templates
+        from mtglabels.resources import Resources
+
+        self.jobs = jobs
+        self.cache_entries = cache_entries or config.SERVE_CACHE_ENTRIES
+        self.catalog_ttl = config.CATALOG_TTL if catalog_ttl is None else catalog_ttl
+        self.resources = Resources(offline=offline, catalog_ttl=catalog_ttl)
+        if jobs > 1:
+            self.resources.start_pool(jobs)
+        self.templates = precompile_templates()
+        self.generators = {name: load_generator(name) for name in ("sets", "color")}
+
+        # Request key -> PDF bytes, least recently used first
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Generators change module-level set filters and share the icon
+        # library, so one request is generated at a time
+        self.generate_lock = threading.Lock()
+        self.results_lock = threading.Lock()
+
+        self.refresh_catalogs()
+
+    def refresh_catalogs(self):
+        """
+        Fetch the catalogs, dropping the cached results built from older ones.
+        """
+        self.resources.catalog.forget()
+        self.resources.sync_sets()
+        self.resources.catalog.fetch(
+            self.resources.session, config.API_ENDPOINT + "/symbology"
+        )
+        with self.results_lock:
+            self.results.clear()
+        self.refreshed_at = time.monotonic()
+
+    def parse_request(self, query):
+        """
+        Validate the query parameters of a label request.
+
+        Args:
+            query (dict): Parsed query string, as returned by parse_qs().
+
+        Returns:
+            tuple: The request key: (generator, sets, labels_per_sheet,
+            template, type, offset_y). Sets are sorted, and options the
+            generator ignores are None, so equivalent requests share a key.
+
+        Raises:
+            BadRequest: If a parameter is invalid.
+        """
+        params = {name: values[-1] for name, values in query.items()}
+
+        name = params.get("generator", "sets")
+        if name not in self.generators:
+            raise BadRequest(f"generator must be one of {', '.join(self.generators)}")
+        generator = self.generators[name]
+
+        sets = ()
+        if name == "sets":
+            sets = tuple(
+                sorted(
+                    {code.strip().lower() for code in params.get("sets", "").split(",")}
+                    - {""}
+                )
+            )
+
+        try:
+            labels_per_sheet = int(
+                params.get("labels_per_sheet", generator.DEFAULT_LABELS_PER_SHEET)
+            )
+            sheet_for(labels_per_sheet)
+        except (KeyError, ValueError):
+            raise BadRequest(
+                "labels_per_sheet must be one of "
+                + ", ".join(
+                    name.split("-")[1] for name in SHEETS if name.startswith("letter-")
+                )
+            )
+
+        template = params.get("template", generator.LABEL_TEMPLATE_FILENAME)
+        if template not in TEMPLATES[name]:
+            raise BadRequest(f"template must be one of {', '.join(TEMPLATES[name])}")
+
+        label_type = offset_y = None
+        if name == "color":
+            label_type = params.get("type", generator.DEFAULT_LABEL_TYPES)
+            if label_type not in LABEL_TYPES:
+                raise BadRequest(f"type must be one of {', '.join(LABEL_TYPES)}")
+            try:
+                offset_y = int(params.get("offset_y", generator.DEFAULT_OFFSET_Y))
+            except ValueError:
+                raise BadRequest("offset_y must be an integer")
+
+        return name, sets, labels_per_sheet, template, label_type, offset_y
+
+    def labels(self, key):
+        """
+        Get the label PDF of a request, from the result cache if possible.
+
+        Args:
+            key (tuple): The request key, see parse_request().
+
+        Returns:
+            tuple: (the PDF as bytes, True if it was served from the cache)
+        """
+        if time.monotonic() - self.refreshed_at >= self.catalog_ttl:
+            with self.generate_lock:
+                if time.monotonic() - self.refreshed_at >= self.catalog_ttl:
+                    self.refresh_catalogs()
+
+        with self.results_lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key], True
+
+        with self.generate_lock:
+            # An identical request may have finished while this one waited
+            with self.results_lock:
+                if key in self.results:
+                    self.hits += 1
+                    return self.results[key], True
+                self.misses += 1
+            pdf = self.generate(*key)
+
+        with self.results_lock:
+            self.results[key] = pdf
+            while len(self.results) > self.cache_entries:
+                self.results.popitem(last=False)
+        return pdf, False
+
+    def generate(self, name, sets, labels_per_sheet, template, label_type, offset_y):
+        """
+        Generate the labels of a request into a temporary output directory.
+
+        Returns:
+            bytes: The combined PDF.
+        """
+        kwargs = (
+            {"label_types": label_type, "offset_y": offset_y} if name == "color" else {}
+        )
+        saved = config.IGNORED_SETS, config.MINIMUM_SET_SIZE, config.SET_TYPES
+        with tempfile.TemporaryDirectory(prefix="mtglabels-serve-") as output_dir:
+            try:
+                generator = self.generators[name](
+                    labels_per_sheet,
+                    output_dir,
+                    jobs=self.jobs,
+                    resources=self.resources,
+                    **kwargs,
+                )
+                generator.LABEL_TEMPLATE_FILENAME = template
+                generator.generate_labels(list(sets) or None)
+            finally:
+                config.IGNORED_SETS, config.MINIMUM_SET_SIZE, config.SET_TYPES = saved
+            return (Path(output_dir) / "combined_labels.pdf").read_bytes()
+
+    def stats(self):
+        """
+        Get the result cache counters.
+        """
+        with self.results_lock:
+            return {
+                "entries": len(self.results),
+                "max_entries": self.cache_entries,
+                "bytes": sum(len(pdf) for pdf in self.results.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def close(self):
+        self.resources.close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self.send_body(
+                200,
+                "application/json",
+                json.dumps(self.server.service.stats()).encode(),
+            )
+            return
+        if url.path != "/labels.pdf":
+            self.send_body(404, "text/plain", b"Not found\n")
+            return
+
+        import requests
+
+        service = self.server.service
+        start = time.perf_counter()
+        try:
+            key = service.parse_request(parse_qs(url.query))
+            pdf, cached = service.labels(key)
+        except BadRequest as e:
+            self.send_body(400, "text/plain", f"{e}\n".encode())
+            return
+        except requests.exceptions.RequestException as e:
+            log.error("Error occurred while making a request: %s", str(e))
+            self.send_body(502, "text/plain", b"Scryfall is unavailable\n")
+            return
+        except Exception as e:
+            log.exception("An unexpected error occurred: %s", str(e))
+            self.send_body(500, "text/plain", b"Label generation failed\n")
+            return
+
+        log.info(
+            f"{url.path}?{url.query}: {'cached' if cached else 'generated'} "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+        self.send_body(
+            200, "application/pdf", pdf, {"X-Cache": "HIT" if cached else "MISS"}
+        )
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def parse_arguments(argv):
+    """
+    Parse command-line arguments.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mtglabels serve",
+        description="Serve label PDFs over HTTP with warm caches",
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8080, help="Port to listen on (default: 8080)"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Render pages in this many worker processes (default: 1)",
+    )
+    parser.add_argument(
+        "--cache-entries",
+        type=int,
+        default=config.SERVE_CACHE_ENTRIES,
+        help=(
+            "Number of generated PDFs kept in memory "
+            f"(default: {config.SERVE_CACHE_ENTRIES})"
+        ),
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached catalogs and icons; never touch the network",
+    )
+    parser.add_argument(
+        "--catalog-ttl",
+        type=int,
+        default=config.CATALOG_TTL,
+        help=(
+            "Seconds the catalogs and cached PDFs are used before the catalogs "
+            f"are revalidated (default: {config.CATALOG_TTL})"
+        ),
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function for the ``mtglabels serve`` subcommand.
+    """
+
+    args = parse_arguments(argv)
+
+    import requests
+
+    try:
+        service = LabelService(
+            jobs=args.jobs,
+            cache_entries=args.cache_entries,
+            offline=args.offline,
+            catalog_ttl=args.catalog_ttl,
+        )
+    except requests.exceptions.RequestException as e:
+        log.error("Error occurred while making a request: %s", str(e))
+        return 1
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.service = service
+    log.info(f"Serving labels on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
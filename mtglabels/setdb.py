@@ -0,0 +1,240 @@
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import mtglabels.config as config
+
+log = logging.getLogger(__name__)
+
+# Columns of the /sets catalog kept in the database
+COLUMNS = (
+    "code",
+    "name",
+    "set_type",
+    "card_count",
+    "released_at",
+    "parent_set_code",
+    "digital",
+    "icon_svg_uri",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sets (
+    code TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    set_type TEXT NOT NULL,
+    card_count INTEGER NOT NULL,
+    released_at TEXT,
+    parent_set_code TEXT,
+    digital INTEGER NOT NULL,
+    icon_svg_uri TEXT,
+    -- Position in the catalog counted from its end; the catalog lists the
+    -- newest sets first, so a new set does not move the existing ones
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sets_released_at ON sets (released_at);
+CREATE INDEX IF NOT EXISTS sets_set_type ON sets (set_type, card_count);
+CREATE INDEX IF NOT EXISTS sets_parent_set_code ON sets (parent_set_code);
+CREATE INDEX IF NOT EXISTS sets_position ON sets (position);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class SetFilter:
+    """
+    Predicates selecting sets from the set database.
+
+    ``set_types`` and ``min_cards`` default to config.SET_TYPES and
+    config.MINIMUM_SET_SIZE, and config.IGNORED_SETS are always left out,
+    read when the filter is applied. Dates are ISO strings, e.g. "2019-06-14".
+    """
+
+    codes: tuple = ()
+    released_after: str = None
+    released_before: str = None
+    set_types: tuple = None
+    min_cards: int = None
+    parent: str = None
+    digital: bool = None
+
+    def where(self):
+        """
+        Build the WHERE clause of the filter.
+
+        Returns:
+            tuple: (SQL expression, list of parameters)
+        """
+        clauses = []
+        params = []
+
+        def add(clause, *values):
+            clauses.append(clause)
+            params.extend(values)
+
+        if config.IGNORED_SETS:
+            add("NOT " + in_clause("code", config.IGNORED_SETS), *config.IGNORED_SETS)
+        min_cards = (
+            config.MINIMUM_SET_SIZE if self.min_cards is None else self.min_cards
+        )
+        if min_cards:
+            add("card_count >= ?", min_cards)
+        set_types = config.SET_TYPES if self.set_types is None else self.set_types
+        if set_types:
+            add(in_clause("set_type", set_types), *set_types)
+        if self.codes:
+            codes = [code.lower() for code in self.codes]
+            add(in_clause("code", codes), *codes)
+        if self.released_after:
+            add("released_at >= ?", str(self.released_after))
+        if self.released_before:
+            add("released_at <= ?", str(self.released_before))
+        if self.parent:
+            add("parent_set_code = ?", self.parent.lower())
+        if self.digital is not None:
+            add("digital = ?", int(self.digital))
+
+        return " AND ".join(clauses) or "1", params
+
+
+def in_clause(column, values):
+    """
+    Build an ``IN`` expression with one parameter per value.
+    """
+    return f"{column} IN ({', '.join('?' * len(values))})"
+
+
+class SetDatabase:
+    """
+    SQLite index of the /sets catalog, queried with indexed predicates
+    instead of filtering the catalog JSON on every run.
+
+    The database is synced from the cached catalog body only when that body
+    changed, and then only the sets that were added, changed or removed are
+    written, so planning a run from an unchanged catalog never decodes the
+    JSON or touches the network.
+    """
+
+    def __init__(self, path=None):
+        """
+        Initialize the SetDatabase.
+
+        Args:
+            path (Path): The database file. Defaults to ``sets.sqlite3`` in config.CACHE_DIR.
+        """
+        self.path = Path(path or Path(config.CACHE_DIR) / "sets.sqlite3")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # The label service uses the database from its request threads, one
+        # request at a time
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def get_meta(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row["value"] if row else None
+
+    def sync(self, body_path):
+        """
+        Sync the database with a cached /sets catalog body.
+
+        Args:
+            body_path (Path): The cached catalog JSON, see CatalogCache.refresh().
+
+        Returns:
+            bool: True if the database changed.
+        """
+        stat = body_path.stat()
+        source = f"{stat.st_size}:{stat.st_mtime_ns}"
+        with self.lock:
+            if self.get_meta("source") == source:
+                log.debug(f"Set database is current with {body_path}")
+                return False
+
+            with body_path.open("rb") as fd:
+                data = json.load(fd).get("data", [])
+            rows = {
+                exp["code"]: (
+                    exp["code"],
+                    exp["name"],
+                    exp["set_type"],
+                    exp["card_count"],
+                    exp.get("released_at"),
+                    exp.get("parent_set_code"),
+                    int(exp.get("digital", False)),
+                    exp.get("icon_svg_uri"),
+                    position,
+                )
+                for position, exp in enumerate(reversed(data))
+            }
+            stored = {
+                row["code"]: tuple(row)
+                for row in self.connection.execute(
+                    f"SELECT {', '.join(COLUMNS)}, position FROM sets"
+                )
+            }
+            changed = [row for code, row in rows.items() if stored.get(code) != row]
+            removed = [(code,) for code in stored.keys() - rows.keys()]
+
+            with self.connection:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO sets ({', '.join(COLUMNS)}, position) "
+                    f"VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                    changed,
+                )
+                self.connection.executemany("DELETE FROM sets WHERE code = ?", removed)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('source', ?)",
+                    (source,),
+                )
+        log.info(
+            f"Synced set database: {len(changed)} sets added or changed, "
+            f"{len(removed)} removed"
+        )
+        return bool(changed or removed)
+
+    def select(self, set_filter=None):
+        """
+        Select sets, in catalog order.
+
+        Args:
+            set_filter (SetFilter): The predicates. Defaults to the configured set filters.
+
+        Returns:
+            list: List of set data dictionaries with the columns of COLUMNS.
+        """
+        set_filter = set_filter or SetFilter()
+        where, params = set_filter.where()
+        with self.lock:
+            if set_filter.codes:
+                codes = [code.lower() for code in set_filter.codes]
+                known_sets = {
+                    row["code"]
+                    for row in self.connection.execute(
+                        f"SELECT code FROM sets WHERE {in_clause('code', codes)}",
+                        codes,
+                    )
+                }
+                unknown_sets = set(codes) - known_sets
+                if unknown_sets:
+                    log.warning("Unknown sets: %s", ", ".join(unknown_sets))
+
+            rows = self.connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM sets WHERE {where} "
+                "ORDER BY position DESC",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self.connection.close()
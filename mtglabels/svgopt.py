@@ -0,0 +1,572 @@
+"""
+Optimize SVG icons before they are inlined into label sheets.
+
+A Python port of the SVGO passes the project used to run with
+``update_svgs.js``: comments, metadata, editor data and raster images are
+removed, styles become attributes, basic shapes become paths, adjacent paths
+that cannot overlap are merged, and path data and whitespace are minified.
+Smaller icons make every page cheaper for cairosvg to parse and draw.
+
+Optimized icons are cached by the hash of their source, so an icon is
+optimized once, however many URLs or runs refer to it. Directories of icons
+can be optimized with::
+
+    mtglabels optimize output svg
+"""
+
+import argparse
+import hashlib
+import logging
+import math
+import re
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import mtglabels.config as config
+
+log = logging.getLogger(__name__)
+
+# Bumped whenever the optimized output changes, invalidating cached results
+OPTIMIZER_VERSION = 1
+
+SVG_URI = "http://www.w3.org/2000/svg"
+SVG_NS = "{" + SVG_URI + "}"
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+# Presentation attributes that can replace declarations of a style attribute
+PRESENTATION_ATTRIBUTES = {
+    "clip-path",
+    "clip-rule",
+    "color",
+    "display",
+    "fill",
+    "fill-opacity",
+    "fill-rule",
+    "filter",
+    "mask",
+    "opacity",
+    "stop-color",
+    "stop-opacity",
+    "stroke",
+    "stroke-dasharray",
+    "stroke-dashoffset",
+    "stroke-linecap",
+    "stroke-linejoin",
+    "stroke-miterlimit",
+    "stroke-opacity",
+    "stroke-width",
+    "visibility",
+}
+
+# Attributes that tie a path to other elements or to its own bounding box;
+# paths using them are never merged
+UNMERGEABLE_ATTRIBUTES = {
+    "id",
+    "style",
+    "clip-path",
+    "mask",
+    "filter",
+    "marker-start",
+    "marker-mid",
+    "marker-end",
+}
+
+RASTER_IMAGE = re.compile(r"(\.(png|jpe?g|gif)$)|(^data:image/(png|jpe?g|gif))", re.I)
+
+# Number of arguments of every path command
+PATH_ARGUMENTS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2}
+PATH_ARGUMENTS.update(A=7, Z=0)
+SEPARATOR = re.compile(r"[\s,]*")
+COMMAND = re.compile(r"[\s,]*([MLHVCSQTAZ])", re.I)
+NUMBER = re.compile(r"[\s,]*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+ARC_FLAG = re.compile(r"[\s,]*([01])")
+
+
+def parse_path(d):
+    """
+    Parse path data into commands.
+
+    Implicit repetitions are made explicit, so every command has exactly its
+    own arguments; the implicit line-tos after a move-to become L / l.
+
+    Args:
+        d (str): The path data.
+
+    Returns:
+        list: (command, list of numbers) tuples.
+
+    Raises:
+        ValueError: If the path data is malformed.
+    """
+    commands = []
+    command = None
+    position = SEPARATOR.match(d).end()
+    while position < len(d):
+        match = COMMAND.match(d, position)
+        if match:
+            command = match.group(1)
+            position = match.end()
+            if command in "Zz":
+                commands.append((command, []))
+                position = SEPARATOR.match(d, position).end()
+                continue
+        elif command is None or command in "Zz":
+            raise ValueError(f"Missing path command at {position}")
+        elif command in "Mm":
+            command = "L" if command == "M" else "l"
+
+        arguments = []
+        for index in range(PATH_ARGUMENTS[command.upper()]):
+            pattern = ARC_FLAG if command in "Aa" and index in (3, 4) else NUMBER
+            match = pattern.match(d, position)
+            if not match:
+                raise ValueError(f"Missing path argument at {position}")
+            arguments.append(float(match.group(1)))
+            position = match.end()
+        commands.append((command, arguments))
+        position = SEPARATOR.match(d, position).end()
+    return commands
+
+
+def format_number(value, precision):
+    """
+    Format a number as briefly as possible, e.g. ``0.5`` as ``.5``.
+    """
+    text = f"{round(value, precision):.{precision}f}".rstrip("0").rstrip(".")
+    if text in ("-0", ""):
+        return "0"
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+def format_path(commands, precision):
+    """
+    Serialize path commands as compactly as possible.
+
+    Numbers are rounded to ``precision`` decimals, separators are left out
+    where a sign, decimal point or arc flag delimits a number, and repeated commands,
+    or line-tos following a move-to, are written once.
+    """
+    parts = []
+    # The command that further numbers repeat; a move-to continues as line-to
+    implicit = previous_number = None
+    for command, arguments in commands:
+        if command != implicit:
+            parts.append(command)
+            previous_number = None
+        for index, value in enumerate(arguments):
+            number = format_number(value, precision)
+            # Arc flags are single digits, so the number after one needs no
+            # separator
+            after_flag = command in "Aa" and index in (4, 5)
+            if previous_number is not None and not (
+                after_flag
+                or number.startswith("-")
+                or (number.startswith(".") and "." in previous_number)
+            ):
+                parts.append(" ")
+            parts.append(number)
+            previous_number = number
+        implicit = {"M": "L", "m": "l", "Z": None, "z": None}.get(command, command)
+    return "".join(parts)
+
+
+def path_bounds(commands):
+    """
+    Compute a box containing a path.
+
+    Control points are included and arcs are bounded by their radii, so the
+    box may be larger than the path but never smaller.
+
+    Returns:
+        tuple: (min_x, min_y, max_x, max_y), or None for an empty path.
+    """
+    xs = []
+    ys = []
+    x = y = start_x = start_y = 0.0
+    for command, arguments in commands:
+        relative = command.islower()
+        upper = command.upper()
+        if upper == "Z":
+            x, y = start_x, start_y
+            continue
+        if upper == "H":
+            x = x + arguments[0] if relative else arguments[0]
+        elif upper == "V":
+            y = y + arguments[0] if relative else arguments[0]
+        elif upper == "A":
+            rx, ry = abs(arguments[0]), abs(arguments[1])
+            end_x = x + arguments[5] if relative else arguments[5]
+            end_y = y + arguments[6] if relative else arguments[6]
+            radius = max(rx, ry, math.hypot(end_x - x, end_y - y) / 2)
+            for point_x, point_y in ((x, y), (end_x, end_y)):
+                xs += [point_x - radius, point_x + radius]
+                ys += [point_y - radius, point_y + radius]
+            x, y = end_x, end_y
+        else:
+            points = list(zip(arguments[::2], arguments[1::2]))
+            if relative:
+                points = [(x + dx, y + dy) for dx, dy in points]
+            xs += [point[0] for point in points]
+            ys += [point[1] for point in points]
+            x, y = points[-1]
+        xs.append(x)
+        ys.append(y)
+        if upper == "M":
+            start_x, start_y = x, y
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def overlap(first, second):
+    """
+    Check whether two boxes overlap or touch.
+    """
+    return not (
+        first[2] < second[0]
+        or second[2] < first[0]
+        or first[3] < second[1]
+        or second[3] < first[1]
+    )
+
+
+def shape_to_path(element):
+    """
+    Get the path data of a basic shape, or None if it is kept as is.
+    """
+    tag = element.tag
+
+    def number(name):
+        return float(re.sub(r"px$", "", element.get(name, "0")))
+
+    if tag == "rect" and not (element.get("rx") or element.get("ry")):
+        x, y, width, height = (number(name) for name in ("x", "y", "width", "height"))
+        return [("M", [x, y]), ("H", [x + width]), ("V", [y + height])] + [
+            ("H", [x]),
+            ("Z", []),
+        ]
+    if tag == "line":
+        return [
+            ("M", [number("x1"), number("y1")]),
+            ("L", [number("x2"), number("y2")]),
+        ]
+    if tag in ("polyline", "polygon"):
+        values = [float(value) for value in NUMBER.findall(element.get("points", ""))]
+        points = list(zip(values[::2], values[1::2]))
+        if len(points) < 2:
+            return None
+        commands = [("M", list(points[0]))]
+        commands += [("L", list(point)) for point in points[1:]]
+        if tag == "polygon":
+            commands.append(("Z", []))
+        return commands
+    return None
+
+
+class Optimizer:
+    """
+    A single optimization of an SVG document.
+    """
+
+    def __init__(self, precision):
+        self.precision = precision
+
+    def run(self, data):
+        root = ET.fromstring(data)
+        if root.tag not in (SVG_NS + "svg", "svg"):
+            raise ValueError("Not an SVG document")
+        self.clean(root)
+        # Style sheets may apply strokes by class, so paths are left alone
+        if root.find(".//style") is None:
+            self.merge_paths(root, stroked=False)
+
+        # Dimensions are given by the label templates; the viewBox scales
+        if root.get("viewBox"):
+            root.attrib.pop("width", None)
+            root.attrib.pop("height", None)
+        for name in ("version", "baseProfile", "x", "y"):
+            root.attrib.pop(name, None)
+        root.set("xmlns", SVG_URI)
+        # Attribute values escape ">", so this only shortens empty elements
+        return ET.tostring(root, encoding="unicode").replace(" />", "/>").encode()
+
+    def clean(self, element):
+        """
+        Clean ``element`` and its children: drop foreign and unwanted nodes,
+        normalize attributes and convert shapes to paths.
+        """
+        element.tag = element.tag.removeprefix(SVG_NS)
+        for child in list(element):
+            tag = child.tag.removeprefix(SVG_NS)
+            if (
+                tag.startswith("{")
+                or tag in ("metadata", "desc", "title")
+                or (
+                    tag == "image"
+                    and RASTER_IMAGE.search(
+                        child.get(XLINK_HREF) or child.get("href") or ""
+                    )
+                )
+            ):
+                element.remove(child)
+            else:
+                self.clean(child)
+
+        for name, value in list(element.attrib.items()):
+            if name.startswith("{"):
+                del element.attrib[name]
+                if name != XLINK_HREF:
+                    continue
+                name = "href"
+            element.set(name, " ".join(value.split()))
+
+        self.style_to_attributes(element)
+
+        if element.tag in ("rect", "line", "polyline", "polygon"):
+            try:
+                commands = shape_to_path(element)
+            except ValueError:
+                commands = None
+            if commands:
+                for name in ("x", "y", "width", "height", "x1", "y1", "x2", "y2"):
+                    element.attrib.pop(name, None)
+                element.attrib.pop("points", None)
+                element.tag = "path"
+                element.set("d", format_path(commands, self.precision))
+        elif element.tag == "path" and element.get("d"):
+            try:
+                commands = parse_path(element.get("d"))
+            except ValueError as e:
+                log.debug(f"Keeping unparsable path data: {e}")
+            else:
+                element.set("d", format_path(commands, self.precision))
+
+        if element.tag != "text":
+            if element.text and not element.text.strip():
+                element.text = None
+            for child in element:
+                if child.tail and not child.tail.strip():
+                    child.tail = None
+
+    def style_to_attributes(self, element):
+        """
+        Move presentation properties from ``style`` to attributes.
+        """
+        style = element.get("style")
+        if style is None:
+            return
+        kept = []
+        for declaration in style.split(";"):
+            name, _, value = (part.strip() for part in declaration.partition(":"))
+            if not name:
+                continue
+            if name in PRESENTATION_ATTRIBUTES and "!important" not in value:
+                element.set(name, value)
+            else:
+                kept.append(f"{name}:{value}")
+        if kept:
+            element.set("style", ";".join(kept))
+        else:
+            del element.attrib["style"]
+
+    def merge_paths(self, element, stroked):
+        """
+        Merge runs of adjacent paths with the same attributes whose bounds
+        do not overlap, so they draw the same merged as separately.
+        """
+        if element.get("stroke") is not None:
+            stroked = element.get("stroke") != "none"
+
+        previous = None
+        for child in list(element):
+            self.merge_paths(child, stroked)
+            if previous is None or not self.mergeable(previous, child, stroked):
+                previous = child
+                continue
+            try:
+                first = parse_path(previous.get("d"))
+                second = parse_path(child.get("d"))
+            except ValueError:
+                previous = child
+                continue
+            first_bounds, second_bounds = path_bounds(first), path_bounds(second)
+            if not first_bounds or not second_bounds:
+                previous = child
+                continue
+            if overlap(first_bounds, second_bounds):
+                previous = child
+                continue
+            # A leading relative move-to is absolute; keep it so once appended
+            if second[0][0] == "m":
+                second[0] = ("M", second[0][1])
+            previous.set("d", format_path(first + second, self.precision))
+            element.remove(child)
+
+    @staticmethod
+    def mergeable(first, second, stroked):
+        """
+        Check whether two paths draw alike and could be merged.
+        """
+        if first.tag != "path" or second.tag != "path" or len(first) or len(second):
+            return False
+        attributes = dict(first.attrib), dict(second.attrib)
+        for names in attributes:
+            if not names.get("d") or UNMERGEABLE_ATTRIBUTES & names.keys():
+                return False
+            del names["d"]
+        # A stroke reaches outside the bounds of its path
+        stroke = attributes[0].get("stroke")
+        if stroke is not None:
+            stroked = stroke != "none"
+        return attributes[0] == attributes[1] and not stroked
+
+
+def optimize_svg(data, precision=None):
+    """
+    Optimize an SVG document.
+
+    Args:
+        data (bytes): The SVG document.
+        precision (int): Decimals kept in path data. Defaults to config.SVG_PRECISION.
+
+    Returns:
+        bytes: The optimized document.
+
+    Raises:
+        xml.etree.ElementTree.ParseError: If the document is not valid SVG.
+    """
+    return Optimizer(config.SVG_PRECISION if precision is None else precision).run(data)
+
+
+class SvgOptimizer:
+    """
+    Cache of optimized SVG icons, keyed by the hash of their source.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        Initialize the SvgOptimizer.
+
+        Args:
+            cache_dir (Path): Directory holding the optimized icons. Defaults to ``optimized`` in config.CACHE_DIR.
+        """
+        self.cache_dir = Path(cache_dir or Path(config.CACHE_DIR) / "optimized")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Counters for this run
+        self.optimized = 0
+        self.saved_bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(data):
+        """
+        Get the cache key of an icon's contents.
+        """
+        key = f"{OPTIMIZER_VERSION}:{config.SVG_PRECISION}:".encode() + data
+        return hashlib.sha256(key).hexdigest()[:24]
+
+    def path_for(self, digest):
+        return self.cache_dir / f"{digest}.svg"
+
+    def counters(self):
+        """
+        Get the counters of this run.
+
+        Returns:
+            dict: Icons optimized, and bytes saved by optimizing them.
+        """
+        with self.lock:
+            return {"optimized": self.optimized, "saved_bytes": self.saved_bytes}
+
+    def optimize(self, file_path):
+        """
+        Get the optimized version of an icon, optimizing it unless cached.
+
+        Args:
+            file_path (Path): The SVG icon.
+
+        Returns:
+            tuple: (path of the optimized icon, digest), or (``file_path``,
+            None) if the icon cannot be optimized.
+        """
+        data = Path(file_path).read_bytes()
+        digest = self.digest(data)
+        target = self.path_for(digest)
+        if target.exists():
+            return target, digest
+
+        try:
+            optimized = optimize_svg(data)
+        except (ET.ParseError, ValueError) as e:
+            log.warning(f"Not optimizing {file_path}: {e}")
+            return Path(file_path), None
+
+        # Icons sharing their contents may be optimized by several threads
+        part_path = target.with_name(f"{target.name}.{threading.get_ident()}.part")
+        part_path.write_bytes(optimized)
+        part_path.replace(target)
+        with self.lock:
+            self.optimized += 1
+            self.saved_bytes += len(data) - len(optimized)
+        return target, digest
+
+
+def optimize_directory(source_dir, target_dir):
+    """
+    Optimize every SVG file of a directory into another directory.
+
+    Returns:
+        int: The number of files that could not be optimized.
+    """
+    target_dir.mkdir(parents=True, exist_ok=True)
+    failed = 0
+    for file_path in sorted(source_dir.glob("*.svg")):
+        data = file_path.read_bytes()
+        try:
+            optimized = optimize_svg(data)
+        except (ET.ParseError, ValueError) as e:
+            log.error(f"Failed to optimize {file_path}: {e}")
+            failed += 1
+            continue
+        (target_dir / file_path.name).write_bytes(optimized)
+        log.info(f"Processed {file_path.name} ({len(data)} -> {len(optimized)} bytes)")
+    return failed
+
+
+def parse_arguments(argv):
+    """
+    Parse command-line arguments.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mtglabels optimize",
+        description="Optimize the SVG files of a directory into another directory",
+    )
+    parser.add_argument(
+        "source_dir",
+        type=Path,
+        nargs="?",
+        default=Path("output"),
+        help="(default: output)",
+    )
+    parser.add_argument(
+        "target_dir", type=Path, nargs="?", default=Path("svg"), help="(default: svg)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Main function for the ``mtglabels optimize`` subcommand.
+    """
+
+    args = parse_arguments(argv)
+    return 1 if optimize_directory(args.source_dir, args.target_dir) else 0
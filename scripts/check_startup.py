@@ -0,0 +1,105 @@
+"""
+Check the startup cost of the ``mtglabels`` CLI.
+
+Runs ``mtglabels --help`` under ``python -X importtime`` and fails when a heavy
+dependency is imported or the import time exceeds the budget. The budget is
+counted on top of the import time of ``python -c pass`` measured in the same
+run, so a slower machine does not fail the check on interpreter startup alone.
+
+    python scripts/check_startup.py --budget-ms 250
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Dependencies that must only be imported by the stage that uses them
+HEAVY_MODULES = ("cairosvg", "cairocffi", "PyPDF2", "jinja2", "requests", "urllib3")
+
+# Measurements of every command; the fastest is kept to reduce noise
+RUNS = 3
+
+# Command measuring the imports of the interpreter itself
+BASELINE = ["-c", "pass"]
+
+# Commands that must start without the heavy dependencies
+COMMANDS = (
+    ["mtglabels/generator.py", "--help"],
+    ["mtglabels/generator.py", "cache", "--help"],
+    ["mtglabels/generator.py", "batch", "--help"],
+    ["mtglabels/generator.py", "serve", "--help"],
+    ["mtglabels/generator.py", "optimize", "--help"],
+    ["mtglabels/generator-color.py", "--help"],
+)
+
+
+def import_times(command):
+    """
+    Run a command under ``-X importtime``.
+
+    Returns:
+        dict: Self import time in microseconds of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *command],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def total_ms(command):
+    """
+    Measure the total import time of a command, keeping the fastest run.
+
+    Returns:
+        tuple: (total import time in ms, import times of the fastest run)
+    """
+    runs = [import_times(command) for _ in range(RUNS)]
+    times = min(runs, key=lambda times: sum(times.values()))
+    return sum(times.values()) / 1000, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=250,
+        help="Maximum import time of a command in ms on top of python -c pass "
+        "(default: 250)",
+    )
+    args = parser.parse_args()
+
+    baseline_ms, _ = total_ms(BASELINE)
+    print(f"     {baseline_ms:7.1f} ms  python -c pass")
+
+    failed = False
+    for command in COMMANDS:
+        command_ms, times = total_ms(command)
+        extra_ms = command_ms - baseline_ms
+        heavy = sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+        status = "ok"
+        if heavy or extra_ms > args.budget_ms:
+            status = "FAIL"
+            failed = True
+        print(f"{status:4} {extra_ms:+7.1f} ms  {' '.join(command)}")
+        if heavy:
+            print(f"     imports heavy modules: {', '.join(heavy)}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())